@@ -0,0 +1,13 @@
+"""Loading datum tables (per-second onboard telemetry .csv files)
+
+>>> from datum_loader import read_datum
+>>> df = read_datum('data/datum_tables/datum_2013_sec.csv', columns=['H', 'P_hpa1'])
+
+Datetimes are assembled arithmetically from year, month, day and time (HHMMSS)
+columns. Parsed columns are cached in a sidecar directory of .npy files next to the .csv,
+so subsequent loads skip CSV parsing altogether.
+"""
+
+from .datum import DATE_COLUMNS, datum_datetime, read_datum
+
+__all__ = ['DATE_COLUMNS', 'datum_datetime', 'read_datum']
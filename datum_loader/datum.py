@@ -0,0 +1,131 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+DATE_COLUMNS = ['year', 'month', 'day', 'time']
+
+
+def datum_datetime(df: pd.DataFrame) -> pd.Series:
+    """Assemble datetime from year, month, day and time (HHMMSS) integer columns of datum
+
+    Args:
+        df (pd.DataFrame): read from datum .csv file
+
+    Returns:
+        pd.Series: datetime64 Series named 'datetime'
+    """
+    year, month, day, time = (df[column].to_numpy().astype(np.int64) for column in DATE_COLUMNS)
+    months = (year - 1970) * 12 + month - 1
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    seconds = time // 10000 * 3600 + time // 100 % 100 * 60 + time % 100
+    datetime = dates.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')
+    return pd.Series(datetime, index=df.index, name='datetime')
+
+
+def _cache_dir(csv_path: Path) -> Path:
+    return csv_path.with_name(csv_path.name + '.cache')
+
+
+def _mtime_path(csv_path: Path) -> Path:
+    return _cache_dir(csv_path) / '__mtime_ns.npy'
+
+
+def _cache_is_valid(csv_path: Path) -> bool:
+    mtime_path = _mtime_path(csv_path)
+    return mtime_path.exists() and int(np.load(mtime_path)) == csv_path.stat().st_mtime_ns
+
+
+def _read_cache(csv_path: Path, columns: List[str]) -> Dict[str, np.ndarray]:
+    """Requested columns cached for the current version of .csv file, missing ones are skipped"""
+    if not _cache_is_valid(csv_path):
+        return dict()
+    cached = dict()
+    for column in columns:
+        column_path = _cache_dir(csv_path) / f'{column}.npy'
+        if column_path.exists():
+            try:
+                cached[column] = np.load(column_path)
+            except ValueError:  # object array pickled by an older version, re-parsed from .csv
+                continue
+    return cached
+
+
+def _save_atomically(path: Path, array: np.ndarray):
+    # written via temporary file so that concurrent readers never see partial cache
+    tmp_path = path.with_name(path.name + '.tmp.npy')
+    np.save(tmp_path, array)
+    tmp_path.replace(path)
+
+
+def _is_cacheable(values: np.ndarray) -> bool:
+    # object arrays (strings) can only be saved pickled, they are parsed from .csv every time instead
+    return values.dtype.kind in 'biufcmM'
+
+
+def _write_cache(csv_path: Path, columns: Dict[str, np.ndarray]):
+    """Add numeric and datetime columns to cache, one .npy file per column,
+    so that other cached columns are not rewritten"""
+    cache_dir = _cache_dir(csv_path)
+    cache_dir.mkdir(exist_ok=True)
+    if not _cache_is_valid(csv_path):
+        for stale_path in cache_dir.glob('*.npy'):
+            stale_path.unlink()
+    for column, values in columns.items():
+        if _is_cacheable(values):
+            _save_atomically(cache_dir / f'{column}.npy', values)
+    _save_atomically(_mtime_path(csv_path), np.int64(csv_path.stat().st_mtime_ns))
+
+
+def read_datum(
+    csv_path: Union[str, Path], columns: Optional[List[str]] = None, cache: bool = True
+) -> pd.DataFrame:
+    """Read datum table with 'datetime' column instead of year, month, day and time
+
+    Only requested columns are parsed (and loaded from cache), with types inferred
+    by pandas as usual: integer columns stay int64 unless they have missing values.
+    With cache=True, parsed columns are stored in '<csv name>.cache' sidecar directory,
+    one .npy file per column, valid while .csv modification time stays the same;
+    columns missing from the cache are parsed from .csv and added to it. Non-numeric
+    (object) columns are not cached and are parsed from .csv on every call.
+
+    Args:
+        csv_path (str | Path): datum .csv file
+        columns (list of str | None): columns to read, all by default
+        cache (bool): use sidecar cache
+
+    Returns:
+        pd.DataFrame: 'datetime' column followed by requested columns in file order
+    """
+    csv_path = Path(csv_path)
+    all_columns = [c for c in pd.read_csv(csv_path, nrows=0).columns if c not in DATE_COLUMNS]
+    if columns is None:
+        columns = all_columns
+    else:
+        unknown = set(columns) - set(all_columns)
+        if unknown:
+            raise ValueError(f"No columns {sorted(unknown)} in '{csv_path}'")
+        columns = [c for c in all_columns if c in set(columns)]
+
+    cached = _read_cache(csv_path, ['datetime', *columns]) if cache else dict()
+    to_parse = [c for c in columns if c not in cached]
+    if 'datetime' not in cached:
+        to_parse_with_dates = DATE_COLUMNS + to_parse
+    else:
+        to_parse_with_dates = to_parse
+    if to_parse_with_dates:
+        parsed = pd.read_csv(
+            csv_path,
+            usecols=to_parse_with_dates,
+            dtype={c: np.int64 for c in to_parse_with_dates if c in DATE_COLUMNS},
+        )
+        new_columns = {c: parsed[c].to_numpy() for c in to_parse}
+        if 'datetime' not in cached:
+            new_columns['datetime'] = datum_datetime(parsed).to_numpy()
+        if cache:
+            _write_cache(csv_path, new_columns)
+        cached.update(new_columns)
+
+    return pd.DataFrame({'datetime': cached['datetime'], **{c: cached[c] for c in columns}})
@@ -1,87 +1,123 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from operator import attrgetter
 from warnings import warn
 
+from datum_loader import DATE_COLUMNS, read_datum
 
-DATUM_DIR = Path(".\\data\\datum_tables")
-
-
-def datum_datetime(df: pd.DataFrame):
-    """Parse datetime object from several columns in datum
 
-    Args:
-        df (pd.DataFrame): read from datum .csv file
-
-    Returns:
-        pd.Series: parsed datetime64 Series
-    """
-    datetime = (
-        df.loc[:, "time"]
-        .astype(str)
-        .str.cat(
-            others=[
-                df.loc[:, "year"].astype(str),
-                df.loc[:, "month"].astype(str).apply(lambda s: s.rjust(2, "0")),
-                df.loc[:, "day"].astype(str).apply(lambda s: s.rjust(2, "0")),
-            ],
-            sep=" ",
-        )
-    )
-
-    datetime = pd.to_datetime(datetime, format=r"%H%M%S %Y %m %d")
-    datetime.name = "datetime"
-
-    return datetime
+DATUM_DIR = Path(".\\data\\datum_tables")
 
 
 def read_datum_for_year(year):
     """Read specific datum and prepare datetime index"""
     datum_filename = DATUM_DIR / f"datum_{year}_sec.csv"
     try:
-        df = pd.read_csv(datum_filename)
+        df = read_datum(datum_filename)
     except FileNotFoundError:
         warn(f"No datum file found for the year {year}; check for '{datum_filename}'")
         return None
-    df.insert(0, "datetime", datum_datetime(df))
     df.set_index("datetime", inplace=True, drop=False)
     df.index.name = "local_dt_index"
-    df.drop(columns=["year", "month", "day", "time"], inplace=True)
     return df
 
 
-def telemetry_data_at(datetimes, columns):
+class DatumStore:
+    """Datum tables loaded once and kept in memory as sorted per-column arrays
+
+    Each (year, column) is read on first request; queries interpolate only
+    the requested points with binary search, so the store is cheap to query
+    many times.
+    """
+
+    def __init__(self, datum_dir=DATUM_DIR):
+        self.datum_dir = Path(datum_dir)
+        self._columns = dict()  # (year, column) -> (ns timestamps, values) of valid values
+        self._year_columns = dict()  # year -> data columns of the datum file
+        self._missing_years = set()
+
+    def year_columns(self, year):
+        """Data columns (all but date ones) of datum file for year; None if no datum"""
+        if year not in self._year_columns:
+            if year in self._missing_years:
+                return None
+            datum_filename = self.datum_dir / f"datum_{year}_sec.csv"
+            try:
+                header = pd.read_csv(datum_filename, nrows=0).columns
+            except FileNotFoundError:
+                warn(f"No datum file found for the year {year}; check for '{datum_filename}'")
+                self._missing_years.add(year)
+                return None
+            self._year_columns[year] = [column for column in header if column not in DATE_COLUMNS]
+        return self._year_columns[year]
+
+    def column(self, year, column):
+        """Sorted timestamps (int64 ns) and values of 'column' for year, without NaNs; None if no datum"""
+        key = (year, column)
+        if key not in self._columns:
+            if year in self._missing_years:
+                return None
+            datum_filename = self.datum_dir / f"datum_{year}_sec.csv"
+            try:
+                datum = read_datum(datum_filename, columns=[column])
+            except FileNotFoundError:
+                warn(f"No datum file found for the year {year}; check for '{datum_filename}'")
+                self._missing_years.add(year)
+                return None
+            t = datum["datetime"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+            values = datum[column].to_numpy(dtype=float)
+            order = np.argsort(t, kind="stable")
+            t, values = t[order], values[order]
+            valid = ~np.isnan(values)
+            self._columns[key] = (t[valid], values[valid])
+        return self._columns[key]
+
+    def data_at(self, datetimes, columns=None):
+        """See telemetry_data_at"""
+        if not isinstance(datetimes, pd.Series):
+            datetimes = pd.to_datetime(pd.Series(data=datetimes))
+        t_query = datetimes.to_numpy().astype("datetime64[ns]").astype(np.int64)
+        years = datetimes.dt.year.to_numpy()
+        if not columns:
+            # all columns of datum files for the queried years
+            columns = []
+            for year in np.unique(years):
+                for column in self.year_columns(int(year)) or []:
+                    if column not in columns:
+                        columns.append(column)
+
+        data = {column: np.full(len(datetimes), np.nan) for column in columns}
+        for year in np.unique(years):
+            in_year = years == year
+            for column in columns:
+                column_data = self.column(int(year), column)
+                if column_data is None:
+                    break
+                t, values = column_data
+                if len(t) == 0:
+                    continue
+                # same as time interpolation in pandas: NaN before the first value, last value after the last one
+                data[column][in_year] = np.interp(
+                    t_query[in_year], t, values, left=np.nan, right=values[-1]
+                )
+        return pd.DataFrame(data=data, index=pd.DatetimeIndex(datetimes))
+
+
+_datum_store = DatumStore()
+
+
+def telemetry_data_at(datetimes, columns=None):
     """Main function to extract telemetry data for specific datetimes from datum tables.
 
+    Datum tables are loaded once per process, see DatumStore.
+
     Args:
         datetimes (pd.Series with Timestamps or single Timestamp): one or several query datetimes
-        columns (list of str): list of columns to retrieve from datum tables;
+        columns (list of str): list of columns to retrieve from datum tables; all columns if not given
     Returns:
         pd.DataFrame with retrieved columns at queried dates, interpolated where datetimes doesn't match
     """
-    if not isinstance(datetimes, pd.Series):
-        datetimes = pd.to_datetime(pd.Series(data=datetimes))
-
-    query = pd.DataFrame(index=datetimes, columns=columns)
-
-    years = datetimes.copy().map(attrgetter("year"))
-    for year in years.unique():
-        datum = read_datum_for_year(year)
-        if datum is None:
-            continue
-        if columns:
-            datum = datum[columns]
-
-        datetimes_in_year = datetimes[years == year]
-
-        query_year = pd.DataFrame(index=datetimes_in_year, columns=columns)
-        datum = datum.append(query_year).sort_index()
-        datum.interpolate(method="time", inplace=True)
-        datum = datum[~datum.index.duplicated(keep="first")]
-
-        query.loc[datetimes_in_year, :] = datum.loc[datetimes_in_year, :]
-
-    return query
+    return _datum_store.data_at(datetimes, columns)
 
 
 if __name__ == "__main__":
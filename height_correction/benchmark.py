@@ -0,0 +1,126 @@
+"""Speed and accuracy benchmark of height correction on synthetic flights
+
+Flights are generated with known true height, so correction can be checked
+without datum files:
+
+    PYTHONPATH=.. python benchmark.py --hours 10 --flights 5
+
+prints mean time of each stage of process_interval (as reported by the function
+itself, fitting includes all convergence passes) and RMS error of raw
+and corrected H against the truth, overall and within injected glitches.
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import correction
+from config import PSEUDOHEIGH_CONF
+from main import calculate_pseudo_height
+
+
+def synthetic_flight(
+    hours=10,
+    step=1.0,
+    n_glitches=25,
+    dropout_rate=0.02,
+    pressure_noise=0.05,
+    seed=0,
+):
+    """Balloon-like flight with barometric truth and GPS height glitches
+
+    True height is a slow ascent-plateau-descent profile with oscillations,
+    pressure follows it with barometric formula. GPS H gets white noise,
+    glitches (offset plus random walk drift lasting 1-8 min) and dropouts (NaN).
+
+    Args:
+        hours (float): flight duration
+        step (float): sampling period, sec
+        n_glitches (int): number of GPS glitches
+        dropout_rate (float): fraction of records with missing H
+        pressure_noise (float): pressure noise std, hPa
+        seed (int): random seed
+
+    Returns:
+        pd.DataFrame: datetime, H and P_hpa1 columns, as read from datum files
+        np.ndarray: true height at each record
+        np.ndarray: bool mask of records affected by glitches
+    """
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600 / step)
+    t = np.arange(n) * step
+    duration = hours * 3600
+
+    H_true = (
+        PSEUDOHEIGH_CONF["H0"]
+        + 3000 * (1 - np.cos(2 * np.pi * t / duration)) / 2
+        + 50 * np.sin(2 * np.pi * t / 1800)
+    )
+    P = PSEUDOHEIGH_CONF["p0"] * np.exp(
+        -(H_true - PSEUDOHEIGH_CONF["H0"]) / PSEUDOHEIGH_CONF["a"]
+    )
+    P += rng.normal(0, pressure_noise, n)
+
+    H = H_true + rng.normal(0, 2, n)
+    glitch_mask = np.zeros(n, dtype=bool)
+    for _ in range(n_glitches):
+        length = int(rng.integers(60, 500) / step)
+        start = rng.integers(0, n - length)
+        H[start : start + length] += rng.normal(0, 40) + np.cumsum(
+            rng.normal(0, 1, length)
+        )
+        glitch_mask[start : start + length] = True
+    H[rng.random(n) < dropout_rate] = np.nan
+
+    datetime = np.datetime64("2013-03-13T08:00:00", "ns") + (t * 1e9).astype(
+        "timedelta64[ns]"
+    )
+    df = pd.DataFrame({"datetime": datetime, "H": H, "P_hpa1": P})
+    return df, H_true, glitch_mask
+
+
+def rms(x):
+    return np.sqrt(np.nanmean(np.square(x)))
+
+
+def benchmark(n_flights=5, **flight_kwargs) -> pd.DataFrame:
+    """Benchmark height correction on n_flights synthetic flights
+
+    Returns:
+        pd.DataFrame: one row per flight with stage times (sec) and RMS errors (m)
+    """
+    rows = []
+    for seed in range(n_flights):
+        df, H_true, glitch_mask = synthetic_flight(seed=seed, **flight_kwargs)
+        calculate_pseudo_height(df)
+        row = dict()
+        start = perf_counter()
+        diag = correction.process_interval(df, seed, timings=row)
+        row["process_interval"] = perf_counter() - start
+        row["passes"] = diag.n_passes
+
+        error_raw = df["H"].to_numpy() - H_true
+        error_corrected = df["H_corrected"].to_numpy() - H_true
+        row["rms raw"] = rms(error_raw)
+        row["rms corrected"] = rms(error_corrected)
+        row["rms raw in glitches"] = rms(error_raw[glitch_mask])
+        row["rms corrected in glitches"] = rms(error_corrected[glitch_mask])
+        row["rms corrected out of glitches"] = rms(error_corrected[~glitch_mask])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flights", type=int, default=5)
+    parser.add_argument("--hours", type=float, default=10)
+    parser.add_argument("--step", type=float, default=1.0, help="sampling period, sec")
+    parser.add_argument("--glitches", type=int, default=25)
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.flights, hours=args.hours, step=args.step, n_glitches=args.glitches
+    )
+    print(results.mean().to_string(float_format=lambda x: f"{x:.4g}"))
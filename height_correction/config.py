@@ -6,6 +6,11 @@ DATUM_FILES = [
     # 'datum_2012_sec.csv'
 ]
 
+OUTPUT_FILE = "datum_with_corrected_H.csv"
+OUTPUT_CHUNK_ROWS = 100000  # records written to output file at once
+
+N_WORKERS = None  # processes for correcting intervals in parallel, None for one per CPU core
+
 INDICATOR_THRESHOLD = 5  # m
 
 INTERP_TYPE = "linear"
@@ -16,9 +21,11 @@ FILTER_CONF = {
 }
 
 CORRECTION_CONF = {
-    # 'correlation_window': 1200, # sec
+    "correlation_window": 1200,  # sec
     "ma_window": 300,  # sec
     "fitting_window": 120,  # sec
+    "max_fittings": 5,  # upper limit on barometric correction passes
+    "convergence_tol": 1e-3,  # m, samples changed by less are considered converged
 }
 
 PSEUDOHEIGH_CONF = {
@@ -27,10 +34,27 @@ PSEUDOHEIGH_CONF = {
     "a": 8400,  # m, R*T/Mg, approximate
 }
 
+STREAMING_CONF = {
+    "step": 1,  # sec, grid step of streaming correction
+    "max_gap": 600,  # sec, longer breaks in records start a new interval
+    "center_window": 3600,  # sec, time constant of running center of filtered difference
+    "chunksize": 600,  # records read at once from files and document streams
+    "poll_interval": 1,  # sec, how often a growing datum file is checked for new records
+}
+
 TEMP_DIFF_SAMPLE_SAVING = False
 TEMP_DIFF_SAMPLE_FILE = "temp.txt"
 
+# plots are rendered from correction diagnostics in background processes,
+# set everything to False for compute-only runs
 PLOTTING_CONF = {
     "barometric_height_correction": False,
     "H_histogram": True,
+    "filtering_masking": True,
+}
+
+DIAGNOSTICS_CONF = {
+    "save": False,  # save intermediate arrays of each interval to render plots later
+    "dir": "diagnostics",
+    "render_workers": 2,
 }
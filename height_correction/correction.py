@@ -1,26 +1,68 @@
 import numpy as np
-from scipy.stats import pearsonr
-from scipy.optimize import curve_fit
+from collections import namedtuple
+from time import perf_counter
 from scipy.interpolate import interp1d
-from math import copysign
-
-import matplotlib.pyplot as plt
 
 import pandas as pd
 
-from config import CORRECTION_CONF, INDICATOR_THRESHOLD, PLOTTING_CONF
+from config import CORRECTION_CONF, INDICATOR_THRESHOLD
 
 import filtering
 
 
+# relative (to signal variance) threshold of window variance, below which window is considered constant
+CORRELATION_VAR_RTOL = 1e-10
+
+# minimal spread (weighted std) of ln(P) over fitting points for barometric fit to be defined
+BAROMETRIC_FIT_MIN_LN_P_SPREAD = 1e-9
+
+
 def moving_correlation(t, s1, s2):
+    """Pearson correlation of two signals in moving window
+
+    Window length is CORRECTION_CONF["correlation_window"] sec, i-th coefficient is
+    computed on samples [i, i + window). Window sums of x, y, x^2, y^2 and xy are taken
+    from cumulative sums, so the whole run is O(N) regardless of window length.
+
+    Args:
+        t (np.ndarray): uniform time grid
+        s1, s2 (np.ndarray): signals on the grid, either 1D or 2D with one signal per row
+            to process several signal pairs at once
+
+    Returns:
+        t_corr, r_corr (np.ndarray): window end times and correlation coefficients
+            (same number of rows as signals); NaN for windows where any of the signals
+            is (nearly) constant
+    """
     # sec -> t bin
     window = int(CORRECTION_CONF["correlation_window"] / (t[1] - t[0]))
     t_corr = t[window:]
-    r_corr = np.zeros_like(t_corr, dtype=np.dtype("float64"))
-    for i in range(window, len(t)):
-        r_corr[i - window] = pearsonr(s1[i - window:i], s2[i - window:i])[0]
-    return t_corr, r_corr
+
+    # centering greatly reduces round-off errors accumulated in cumulative sums
+    s1 = np.asarray(s1, dtype=np.dtype("float64"))
+    s1 = s1 - np.mean(s1, axis=-1, keepdims=True)
+    s2 = np.asarray(s2, dtype=np.dtype("float64"))
+    s2 = s2 - np.mean(s2, axis=-1, keepdims=True)
+
+    def window_sums(a):
+        cs = np.cumsum(a, axis=-1)
+        cs = np.concatenate((np.zeros_like(cs[..., :1]), cs), axis=-1)
+        return cs[..., window:-1] - cs[..., : -window - 1]
+
+    sum1 = window_sums(s1)
+    sum2 = window_sums(s2)
+    cov = window_sums(s1 * s2) - sum1 * sum2 / window
+    var1 = window_sums(s1 ** 2) - sum1 ** 2 / window
+    var2 = window_sums(s2 ** 2) - sum2 ** 2 / window
+
+    # windows with variance indistinguishable from round-off are treated as constant
+    var_floor1 = CORRELATION_VAR_RTOL * window * np.var(s1, axis=-1, keepdims=True)
+    var_floor2 = CORRELATION_VAR_RTOL * window * np.var(s2, axis=-1, keepdims=True)
+    valid = (var1 > var_floor1) & (var2 > var_floor2)
+
+    r_corr = np.full(cov.shape, np.nan)
+    r_corr[valid] = cov[valid] / np.sqrt(var1[valid] * var2[valid])
+    return t_corr, np.clip(r_corr, -1, 1)
 
 
 def moving_average(a, n):
@@ -51,44 +93,110 @@ def indicator(t, y1, y2):
     return moving_average_smoothing(t, one_sided_diff, n=window_size)
 
 
-def process_interval(df: pd.DataFrame, interval_idx: int = 0):
-    t, (_, H_P) = filtering.to_uniform_grid(df.loc[:, ["datetime", "H", "H_P"]])
-
-    # for fitting
-    _, (H, P) = filtering.to_uniform_grid(df.loc[:, ["datetime", "H", "P_hpa1"]])
-
-    H_P_flt = filtering.filter_array(t, H_P)
-    H_flt = filtering.filter_array(t, H)
-
-    if PLOTTING_CONF["H_histogram"]:
-        plt.clf()
-        plt.hist(H_flt, bins=70, range=[-20, 20])
-        sigma = np.std(H_flt)
-        plt.title(rf"$\sigma = {sigma}$")
-        plt.savefig(f"pics/H-hist-{interval_idx}")
-
-    n_fittings = 5
-    for i in range(n_fittings):
-        print(".", end="")
-
-        t_ind, ind = indicator(t, H_flt, H_P_flt)
-        indicator_mask = np.greater(ind, INDICATOR_THRESHOLD)
-
-        indicator_mask = interp1d(
-            t_ind, indicator_mask, kind="nearest", fill_value=False, bounds_error=False
-        )(t).astype("bool")
-
-        last_end = -1
-        for start, end in filtering.smooth_intervals(
-            filtering.intervals_from_mask(indicator_mask)
-        ):
-            if start > last_end:
-                last_end, corrected_H = barometric_height_correction(
-                    t, H, P, indicator_mask, start, end, interval_idx
-                )
-                H[start:end] = corrected_H
-
-    print("")
+IntervalDiagnostics = namedtuple(
+    "IntervalDiagnostics",
+    field_names=[
+        "interval_idx",
+        "t_start",  # datetime of the first sample, np.datetime64
+        "t",  # uniform time grid, sec from t_start
+        "H",  # GPS height on grid, before correction
+        "H_P",  # pseudo height from pressure on grid
+        "P",  # pressure on grid
+        "H_flt",  # high-pass filtered H
+        "H_P_flt",  # high-pass filtered H_P
+        "t_ind",  # indicator time grid
+        "indicator",  # indicator values on t_ind
+        "indicator_mask",  # indicator threshold mask on t
+        "fits",  # BarometricFits, with parameters from the last pass for each interval
+        "H_corrected",  # corrected H on grid
+        "n_passes",  # number of correction passes done
+        "n_changed",  # number of samples changed by more than convergence_tol in each pass
+    ],
+)
+
+
+def process_interval(
+    df: pd.DataFrame, interval_idx: int = 0, timings: dict = None
+) -> IntervalDiagnostics:
+    """Correct GPS height in continuous interval, adding H_corrected column to df
+
+    The first pass corrects all intervals with high indicator. Fitting windows
+    of some intervals may overlap intervals corrected in the same pass, so their
+    fits are repeated on the updated H, but only for intervals with fitting windows
+    touching samples changed in the previous pass. Passes stop when no sample
+    changes by more than CORRECTION_CONF["convergence_tol"] or after
+    CORRECTION_CONF["max_fittings"] passes.
+
+    Args:
+        df (pd.DataFrame): interval with datetime, H, H_P and P_hpa1 columns
+        interval_idx (int): interval number, stored in diagnostics
+        timings (dict | None): if given, time spent in each stage (sec) is added to it,
+            keyed by stage name (see benchmark.py)
+
+    Returns:
+        IntervalDiagnostics: intermediate arrays, used to render diagnostic plots
+            (see visualizations.render_diagnostics) without redoing the computation
+    """
+    stage_start = perf_counter()
+
+    def stage_done(stage):
+        nonlocal stage_start
+        if timings is not None:
+            now = perf_counter()
+            timings[stage] = timings.get(stage, 0) + now - stage_start
+            stage_start = now
+
+    grid = filtering.UniformGrid(df["datetime"])
+    t = grid.t
+    H, H_P, P = grid.resample(df[["H", "H_P", "P_hpa1"]].to_numpy().T)
+    H_raw = H.copy()
+    stage_done("gridding")
+
+    H_flt, H_P_flt = filtering.filter_bank.filter(t, np.vstack((H, H_P)))
+    stage_done("filtering")
+
+    # indicator is computed on filtered raw H, so it does not change between passes
+    t_ind, ind = indicator(t, H_flt, H_P_flt)
+    indicator_mask = np.greater(ind, INDICATOR_THRESHOLD)
+
+    indicator_mask = interp1d(
+        t_ind, indicator_mask, kind="nearest", fill_value=False, bounds_error=False
+    )(t).astype("bool")
+    stage_done("indicator")
+
+    selected, lefts, rights = select_fitting_windows(
+        t,
+        clear_window_tables(indicator_mask, fitting_window_size(t)),
+        filtering.smooth_intervals(filtering.intervals_from_mask(indicator_mask)),
+    )
+    stage_done("interval detection")
+
+    n_changed = []
+    refit = np.ones(len(selected), dtype=bool)
+    for i in range(CORRECTION_CONF["max_fittings"]):
+        H_before = H.copy()
+        pass_fits = barometric_height_correction(
+            H, P, selected[refit], lefts[refit], rights[refit]
+        )
+        if i == 0:
+            fits = pass_fits
+        else:
+            # keep the latest fit parameters of each interval
+            for field in ("a", "b", "rms", "n_points", "ok"):
+                getattr(fits, field)[refit] = getattr(pass_fits, field)
+
+        changed = np.abs(H - H_before) > CORRECTION_CONF["convergence_tol"]
+        n_changed.append(np.count_nonzero(changed))
+        if not n_changed[-1]:
+            break
+        # refit only intervals with fitting windows touching changed samples
+        changed_before = np.concatenate(([0], np.cumsum(changed)))
+        refit = (changed_before[lefts[:, 1]] > changed_before[lefts[:, 0]]) | (
+            changed_before[rights[:, 1]] > changed_before[rights[:, 0]]
+        )
+        if not refit.any():
+            break
+    stage_done("fitting")
 
     t_df = df["datetime"].to_numpy()
     t_df = t_df - t_df[0]
@@ -97,79 +205,185 @@ def process_interval(df: pd.DataFrame, interval_idx: int = 0):
     )(filtering.timedelta2sec(t_df))
 
     df.insert(len(df.columns), column="H_corrected", value=H_to_df)
+    stage_done("output")
+
+    return IntervalDiagnostics(
+        interval_idx=interval_idx,
+        t_start=df["datetime"].to_numpy()[0],
+        t=t,
+        H=H_raw,
+        H_P=H_P,
+        P=P,
+        H_flt=H_flt,
+        H_P_flt=H_P_flt,
+        t_ind=t_ind,
+        indicator=ind,
+        indicator_mask=indicator_mask,
+        fits=fits,
+        H_corrected=H,
+        n_passes=len(n_changed),
+        n_changed=np.array(n_changed, dtype=int),
+    )
 
 
-def find_adjasent_interval(direction, window, mask, istart):
-    def window_limits(i):
-        if direction > 0:
-            start = i
-            end = min(i + window, len(mask))
-        else:
-            start = max(i - window + 1, 0)
-            end = i + 1
-        return start, end
-
-    def get_window(i):
-        start, end = window_limits(i)
-        return mask[start:end]
-
-    def on_edge(i):
-        if direction > 0:
-            return i == len(mask) - 1
-        else:
-            return i == 0
-
-    i = istart
-    while any(get_window(i)) and not on_edge(i):
-        i = int(i + copysign(1, direction))
-
-    return window_limits(i)
-
-
-def barometric_height_correction(t, H, P, mask, imin, imax, interval_idx: int):
-    window_size = int(CORRECTION_CONF["fitting_window"] / (t[1] - t[0]))
-    left = find_adjasent_interval(-1, window_size, mask, imin)
-    right = find_adjasent_interval(1, window_size, mask, imax - 1)
-
-    def barometric_func(P, P0, a):
-        return H_points[0] - a * np.log(P / P0)
+def fitting_window_size(t):
+    # sec -> t bin
+    return int(CORRECTION_CONF["fitting_window"] / (t[1] - t[0]))
+
+
+def clear_window_tables(mask, window):
+    """Precompute where the closest clear fitting window is for each sample
+
+    Window is clear when there are no masked samples in it. Forward window at
+    sample i is mask[i:i + window], backward one is mask[i - window + 1:i + 1]
+    (both clipped at mask edges). Clearness of all windows is found from
+    prefix sums of the mask, and the nearest clear ones — with running
+    min/max, so the tables are built in O(N) and each lookup is O(1).
+
+    Returns:
+        next_clear (np.ndarray): for each i — the first i' >= i with clear
+            forward window, or the last sample if there is none
+        prev_clear (np.ndarray): for each i — the last i' <= i with clear
+            backward window, or 0 if there is none
+    """
+    mask = np.asarray(mask, dtype=bool)
+    n = len(mask)
+    idx = np.arange(n)
+    masked_before = np.concatenate(([0], np.cumsum(mask)))
+    forward_clear = masked_before[np.minimum(idx + window, n)] == masked_before[idx]
+    backward_clear = masked_before[idx + 1] == masked_before[np.maximum(idx - window + 1, 0)]
+    next_clear = np.minimum.accumulate(np.where(forward_clear, idx, n - 1)[::-1])[::-1]
+    prev_clear = np.maximum.accumulate(np.where(backward_clear, idx, 0))
+    return next_clear, prev_clear
+
+
+def find_adjasent_interval(direction, window, clear_tables, istart):
+    """Closest to istart clear fitting window in given direction, as (start, end) slice limits
+
+    clear_tables are built for the mask with clear_window_tables
+    """
+    next_clear, prev_clear = clear_tables
+    if direction > 0:
+        i = next_clear[istart]
+        return i, min(i + window, len(next_clear))
+    else:
+        i = prev_clear[istart]
+        return max(i - window + 1, 0), i + 1
+
+
+BarometricFits = namedtuple(
+    "BarometricFits",
+    field_names=[
+        "intervals",  # (k, 2) corrected intervals
+        "left",  # (k, 2) fitting windows to the left of intervals
+        "right",  # (k, 2) fitting windows to the right of intervals
+        "a",  # fitted H = b - a * ln(P) model parameters
+        "b",
+        "rms",  # RMS residual on fitting windows, m
+        "n_points",  # number of points in fitting windows
+        "ok",  # False for degenerate fits, H is left uncorrected for them
+    ],
+)
+
+
+def _ranges(starts, ends):
+    """Concatenated np.arange(start, end) for all pairs and index of pair for each element"""
+    lengths = ends - starts
+    range_id = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - offsets[range_id] + starts[range_id], range_id
+
+
+def select_fitting_windows(t, clear_tables, intervals):
+    """Choose intervals to correct and clear fitting windows adjacent to them
+
+    An interval is skipped if the right fitting window of the previous selected
+    interval reaches into it. Thus fitting windows never overlap the following
+    intervals and selected intervals can be fitted independently.
+
+    Returns:
+        selected, lefts, rights (np.ndarray): (k, 2) intervals and their left
+            and right fitting windows
+    """
+    window_size = fitting_window_size(t)
+
+    selected = []
+    lefts = []
+    rights = []
+    last_end = -1
+    for start, end in intervals:
+        if start > last_end:
+            selected.append((start, end))
+            lefts.append(find_adjasent_interval(-1, window_size, clear_tables, start))
+            rights.append(find_adjasent_interval(1, window_size, clear_tables, end - 1))
+            last_end = rights[-1][1]
+    selected = np.array(selected, dtype=int).reshape(-1, 2)
+    lefts = np.array(lefts, dtype=int).reshape(-1, 2)
+    rights = np.array(rights, dtype=int).reshape(-1, 2)
+    return selected, lefts, rights
+
+
+def barometric_height_correction(H, P, selected, lefts, rights):
+    """Correct H in place within intervals with barometric formula H = H0 - a * ln(P / P0)
+
+    The formula is fitted to clear windows adjacent to each interval (see
+    select_fitting_windows). It is linear in ln(P), so all intervals are fitted
+    at once with closed-form weighted least squares (window weights are the same
+    as were used with curve_fit before: sigma = window length ^ 2).
+
+    Returns:
+        BarometricFits: per-interval fit parameters and quality
+    """
+    n_fits = len(selected)
+
+    # fitting points of all intervals, each weighted by its window length
+    left_idx, left_id = _ranges(lefts[:, 0], lefts[:, 1])
+    right_idx, right_id = _ranges(rights[:, 0], rights[:, 1])
+    fit_idx = np.concatenate((left_idx, right_idx))
+    fit_id = np.concatenate((left_id, right_id))
+    window_lengths = np.concatenate(
+        (lefts[left_id, 1] - lefts[left_id, 0], rights[right_id, 1] - rights[right_id, 0])
+    )
+    w = window_lengths.astype(float) ** -4
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.log(P[fit_idx])
+    y = H[fit_idx]
+
+    def per_fit_sum(values):
+        return np.bincount(fit_id, weights=values, minlength=n_fits)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        w_sum = per_fit_sum(w)
+        x_mean = per_fit_sum(w * x) / w_sum
+        y_mean = per_fit_sum(w * y) / w_sum
+        dx = x - x_mean[fit_id]
+        dy = y - y_mean[fit_id]
+        sxx = per_fit_sum(w * dx ** 2)
+        sxy = per_fit_sum(w * dx * dy)
+        slope = sxy / sxx
+        residuals = dy - slope[fit_id] * dx
+        n_points = np.bincount(fit_id, minlength=n_fits)
+        rms = np.sqrt(per_fit_sum(residuals ** 2) / n_points)
+        x_spread = np.sqrt(sxx / w_sum)
+
+    # pressure must vary across fitting points, otherwise slope is undefined
+    ok = np.isfinite(slope) & np.isfinite(rms) & (x_spread > BAROMETRIC_FIT_MIN_LN_P_SPREAD)
+
+    corr_idx, corr_id = _ranges(selected[:, 0], selected[:, 1])
+    corr_mask = ok[corr_id]
+    corr_idx = corr_idx[corr_mask]
+    corr_id = corr_id[corr_mask]
+    H[corr_idx] = y_mean[corr_id] + slope[corr_id] * (np.log(P[corr_idx]) - x_mean[corr_id])
+
+    fits = BarometricFits(
+        intervals=selected,
+        left=lefts,
+        right=rights,
+        a=-slope,
+        b=y_mean - slope * x_mean,
+        rms=rms,
+        n_points=n_points,
+        ok=ok,
+    )
 
-    def barometric_fit(P, H, weights):
-        P0_est = P_points[0]
-        a_est = 8400
-        popt, _ = curve_fit(
-            barometric_func, P, H, p0=[P0_est, a_est], sigma=weights ** (-2)
-        )
-        return popt
-
-    def prepare_data_for_fit(lims):
-        start, end = lims
-        P_data = P[start:end]
-        H_data = H[start:end]
-        return P_data, H_data, (1 / (end - start)) * np.ones_like(P_data)
-
-    P_left, H_left, weights_left = prepare_data_for_fit(left)
-    P_right, H_right, weights_right = prepare_data_for_fit(right)
-
-    P_points = np.array((*P_left, *P_right))
-    H_points = np.array((*H_left, *H_right))
-    weights = np.array((*weights_left, *weights_right))
-
-    if PLOTTING_CONF["barometric_height_correction"]:
-        plt.clf()
-        plt.plot(P_points, H_points, "b.")
-        plt.plot(P[imin:imax], H[imin:imax], "rx")
-
-    try:
-        P0, a = barometric_fit(P_points, H_points, weights)
-        if PLOTTING_CONF["barometric_height_correction"]:
-            smooth_x = np.linspace(np.min(P_points), np.max(P_points), 1000)
-            plt.plot(smooth_x, barometric_func(smooth_x, P0, a), "-r")
-        H_corrected = barometric_func(P[imin:imax], P0, a)
-    except Exception:
-        H_corrected = H[imin:imax]
-
-    if PLOTTING_CONF["barometric_height_correction"]:
-        plt.savefig(f"pics/pic-barometric-corr-{interval_idx}")
-
-    return right[1], H_corrected
+    return fits
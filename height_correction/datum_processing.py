@@ -2,10 +2,8 @@
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from matplotlib import cm
-from matplotlib.colors import Normalize
+from datum_loader import read_datum, datum_datetime
 
 from config import DATA_DIR, DATUM_FILES
 
@@ -19,34 +17,6 @@ slope = 12  # db per octave
 #### Helper functions ####
 
 
-def datum_datetime(df: pd.DataFrame):
-    """Parse datetime object from several columns in datum
-
-    Args:
-        df (pd.DataFrame): read from datum .csv file
-
-    Returns:
-        pd.Series: parsed datetime64 Series
-    """
-    datetime = (
-        df.loc[:, "time"]
-        .astype(str)
-        .str.cat(
-            others=[
-                df.loc[:, "year"].astype(str),
-                df.loc[:, "month"].astype(str).apply(lambda s: s.rjust(2, "0")),
-                df.loc[:, "day"].astype(str).apply(lambda s: s.rjust(2, "0")),
-            ],
-            sep=" ",
-        )
-    )
-
-    datetime = pd.to_datetime(datetime, format=r"%H%M%S %Y %m %d")
-    datetime.name = "datetime"
-
-    return datetime
-
-
 def validate_chunk(ch: pd.DataFrame) -> bool:
     """Check chunk validity for processing
 
@@ -98,6 +68,6 @@ def continuous_intervals(df: pd.DataFrame, dt_tolerance_medians: int = 100):
 
 def intervals_from_datum_files():
     for datum_file in DATUM_FILES:
-        df = pd.read_csv(str(DATA_DIR / datum_file))
+        df = read_datum(DATA_DIR / datum_file)
         for ch in continuous_intervals(df):
             yield ch
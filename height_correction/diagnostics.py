@@ -0,0 +1,40 @@
+"""Saving and loading intermediate arrays of height correction (see correction.IntervalDiagnostics)
+
+Diagnostics are stored as .npz archives, one per interval, so that plots
+can be rendered later or elsewhere with visualizations.render_diagnostics
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from correction import IntervalDiagnostics, BarometricFits
+from config import DIAGNOSTICS_CONF
+
+
+def diagnostics_path(interval_idx: int) -> Path:
+    return Path(DIAGNOSTICS_CONF["dir"]) / f"interval-{interval_idx}.npz"
+
+
+def save_diagnostics(diag: IntervalDiagnostics, path=None) -> Path:
+    path = Path(path) if path is not None else diagnostics_path(diag.interval_idx)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = diag._asdict()
+    for field, value in arrays.pop("fits")._asdict().items():
+        arrays[f"fits__{field}"] = value
+    np.savez_compressed(path, **arrays)
+    return path
+
+
+def load_diagnostics(path) -> IntervalDiagnostics:
+    with np.load(path) as data:
+        fits = BarometricFits(
+            **{field: data[f"fits__{field}"] for field in BarometricFits._fields}
+        )
+        diag = {
+            field: data[field] for field in IntervalDiagnostics._fields if field != "fits"
+        }
+    diag["interval_idx"] = int(diag["interval_idx"])
+    diag["n_passes"] = int(diag["n_passes"])
+    diag["t_start"] = diag["t_start"][()]
+    return IntervalDiagnostics(fits=fits, **diag)
@@ -1,9 +1,6 @@
 from scipy import signal
-from scipy.interpolate import interp1d
 
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
 
 from config import INTERP_TYPE, FILTER_CONF
 
@@ -14,48 +11,40 @@ def intervals_from_mask(mask, polarity=True):
 
     Ex.: [0, 0, 0, 1, 1, 1, 0, 0, 1, 0, 0, 1, 1] -> [(3,6), (8,9), (11,13)]
 
-    Resulting tuples are ready for slicing, i.e.
+    Resulting (k, 2) array rows are ready for slicing, i.e.
     for i, j in intervals_from_mask(mask):
         assert mask[i:j].all() == True
     """
-    if len(mask) == 0:
-        return []
-    if mask[0] == polarity:
-        start_idx = 0
-    else:
-        start_idx = 1
-    intervalends = np.nonzero(np.diff(mask) != False)[0]
-    intervalends = [-1] + list(intervalends) + [len(mask) - 1]
-    return [
-        (intervalends[i] + 1, intervalends[i + 1] + 1)
-        for i in range(start_idx, len(intervalends) - 1, 2)
-    ]
+    mask = np.asarray(mask) == polarity
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    return np.column_stack((np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]))
 
 
-def smooth_intervals(intervals, smallest_gap=30, smallest_length=20):
-    def merge_interval_with_next(intervals, i):
-        before = intervals[:i]
-        merged = (intervals[i][0], intervals[i + 1][1])
-        after = intervals[i + 2 :] if i + 2 < len(intervals) else []
-        return [*before, merged, *after]
-
-    while True:
-        gaps = [
-            intervals[i + 1][0] - intervals[i][1] for i in range(len(intervals) - 1)
-        ]
-        if len(gaps) == 0 or min(gaps) > smallest_gap:
-            break
-        else:
-            intervals = merge_interval_with_next(intervals, np.argmin(gaps))
+def merge_close_intervals(intervals, max_gap):
+    """Merge intervals (sorted, non-overlapping) separated by gaps of max_gap or less"""
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    if len(intervals) == 0:
+        return intervals
+    is_break = intervals[1:, 0] - intervals[:-1, 1] > max_gap
+    starts = intervals[np.concatenate(([True], is_break)), 0]
+    ends = intervals[np.concatenate((is_break, [True])), 1]
+    return np.column_stack((starts, ends))
 
-    while True:
-        lengths = [i[1] - i[0] for i in intervals]
-        if len(lengths) == 0 or min(lengths) > smallest_length:
-            break
-        else:
-            intervals.pop(np.argmin(lengths))
 
-    return intervals
+def drop_short_intervals(intervals, max_length):
+    """Drop intervals with length of max_length or less"""
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    return intervals[intervals[:, 1] - intervals[:, 0] > max_length]
+
+
+def smooth_intervals(intervals, smallest_gap=30, smallest_length=20):
+    """Merge intervals separated by gaps <= smallest_gap, then drop ones with length <= smallest_length
+
+    Merging one gap does not change the others, so all of them are merged in one pass
+    """
+    return drop_short_intervals(
+        merge_close_intervals(intervals, smallest_gap), smallest_length
+    )
 
 
 def normalize_array(a: np.ndarray) -> np.ndarray:
@@ -75,14 +64,125 @@ def extract_time_series(df):
     return (timedelta2sec(t[mask]), y[mask])
 
 
-def to_uniform_grid(x, *y):
+RESAMPLING_KINDS = ("linear", "nearest")
+
+
+class UniformGrid:
+    """Uniform time grid inferred from time stamps to have the same median step
+
+    Positions of grid points among time stamps are found once, so any number of
+    columns sampled at these time stamps are resampled on the grid in one
+    vectorized pass:
+
+    >>> grid = UniformGrid(df["datetime"])
+    >>> H, P = grid.resample(df[["H", "P_hpa1"]].to_numpy().T)
+
+    Args:
+        x (np.ndarray | pd.Series): original time stamps in numeric, datetime64 or timedelta64
+    """
+
+    def __init__(self, x):
+        x = np.asarray(x)
+        x = x - x[0]
+        if np.issubdtype(x.dtype, np.timedelta64):
+            x = timedelta2sec(x)
+        else:
+            try:
+                x = x.astype(np.dtype("float64"))
+            except ValueError:
+                raise ValueError(
+                    "Time stamps must be timedelta64 or be convertible to float64"
+                )
+        self.x = x
+        self.step = np.median(np.diff(x))
+        self.t = np.arange(x[0], x[-1], self.step)
+        # the last time stamp at or before each grid point
+        self._pos = np.searchsorted(x, self.t, side="right") - 1
+
+    def resample(self, ys, kind=INTERP_TYPE, max_gap=None):
+        """Interpolate columns to the grid, skipping NaNs in each of them
+
+        Outside the range of valid values columns are extrapolated from
+        the two outermost ones, as interp1d(..., fill_value="extrapolate") does.
+
+        Args:
+            ys (np.ndarray): (k, n) array, one column per row, or single 1D column
+            kind (str): "linear" or "nearest"
+            max_gap (float | None): if set, grid points between valid values separated
+                by more than max_gap sec, or farther than max_gap sec from valid
+                values when extrapolating, are set to NaN
+
+        Returns:
+            np.ndarray: (k, len(t)) array of resampled columns (or 1D for 1D input);
+                columns with less than two valid values are all NaN
+        """
+        if kind not in RESAMPLING_KINDS:
+            raise ValueError(f"Invalid resampling kind '{kind}'")
+        ys = np.asarray(ys, dtype=np.dtype("float64"))
+        if ys.ndim == 1:
+            return self.resample(ys[np.newaxis, :], kind, max_gap)[0]
+        n = ys.shape[1]
+        if n != len(self.x):
+            raise ValueError(f"Columns have {n} values, but there are {len(self.x)} time stamps")
+
+        valid = ~np.isnan(ys)
+        idx = np.arange(n)
+        last_valid = np.maximum.accumulate(np.where(valid, idx, -1), axis=1)
+        next_valid = np.minimum.accumulate(np.where(valid, idx, n)[:, ::-1], axis=1)
+        next_valid = np.concatenate((np.full((len(ys), 1), n), next_valid), axis=1)[:, ::-1]
+
+        # bracketing valid values for each grid point
+        left = np.take(last_valid, self._pos, axis=1)
+        right = np.take(next_valid, self._pos + 1, axis=1)
+
+        # outside the range of valid values, the two outermost ones are used
+        rows = np.arange(len(ys))[:, np.newaxis]
+        first = next_valid[:, :1]
+        second = next_valid[rows, np.minimum(first + 1, n)]
+        last = last_valid[:, -1:]
+        second_last = last_valid[rows, np.maximum(last - 1, 0)]
+        before = left < 0
+        after = right >= n
+        np.copyto(left, first, where=before)
+        np.copyto(right, second, where=before)
+        np.copyto(left, second_last, where=after)
+        np.copyto(right, last, where=after)
+        # columns with less than two valid values get arbitrary indices, they are NaN-ed below
+        np.clip(left, 0, n - 1, out=left)
+        np.clip(right, 0, n - 1, out=right)
+
+        x_left = np.take(self.x, left)
+        x_right = np.take(self.x, right)
+        dx = x_right - x_left
+        weight = np.divide(self.t - x_left, dx, out=np.zeros_like(dx), where=dx != 0)
+        if kind == "nearest":
+            weight = np.round(weight)
+            np.copyto(weight, 0, where=before)
+            np.copyto(weight, 1, where=after)
+        ys_flat = ys.ravel()
+        y_left = np.take(ys_flat, left + rows * n)
+        y_right = np.take(ys_flat, right + rows * n)
+        ys_grid = y_left + weight * (y_right - y_left)
+
+        ys_grid[second[:, 0] >= n] = np.nan
+        if max_gap is not None:
+            gap = dx.copy()
+            np.copyto(gap, x_left - self.t, where=before)
+            np.copyto(gap, self.t - x_right, where=after)
+            on_valid = (x_left == self.t) & ~before & ~after
+            ys_grid[(gap > max_gap) & ~on_valid] = np.nan
+        return ys_grid
+
+
+def to_uniform_grid(x, *y, max_gap=None):
     """Interpolate signals defined on arbitrary grid to uniform
 
-    Uniform grid is inferred from x to have the same median step.
+    Uniform grid is inferred from x to have the same median step, see UniformGrid.
 
     Args:
         x  (np.ndarray | pd.Series): original time stamps in numeric or timedelta64(ns)
         *y (np.ndarray | pd.Series): arbitrary number of time series
+        max_gap (float | None): see UniformGrid.resample
 
     OR  x  (pd.DataFrame): first column is treated as timestamps, others — as time series
 
@@ -92,40 +192,10 @@ def to_uniform_grid(x, *y):
     if not y:
         df = x
         x = df.iloc[:, 0]
-        y = []
-        for i in range(1, len(df.columns)):
-            y.append(df.iloc[:, i].to_numpy())
-    numpy_args = []
-    for s in (x, *y):
-        if isinstance(s, pd.Series):
-            numpy_args.append(s.to_numpy())
-        else:
-            numpy_args.append(s)
-    x, *ys = numpy_args
-    x = x - x[0]
-    if x.dtype == np.dtype("<m8[ns]"):
-        x = timedelta2sec(x)
-    else:
-        try:
-            x = x.astype(np.dtype("float64"))
-        except ValueError:
-            raise ValueError(
-                "Time stamps must be timedelta64 or be convertible to float64"
-            )
-    x_step = np.median(np.diff(x))
-    x_start = x[0]
-    x_stop = x[-1]
-    x_grid = np.arange(x_start, x_stop, x_step)
-
-    ys_grid = []
-    for y in ys:
-        mask = np.logical_not(np.isnan(y))
-        y_grid = interp1d(x[mask], y[mask], kind=INTERP_TYPE, fill_value="extrapolate")(
-            x_grid
-        )
-        ys_grid.append(y_grid)
-
-    return x_grid, ys_grid
+        y = [df.iloc[:, i].to_numpy() for i in range(1, len(df.columns))]
+    grid = UniformGrid(x)
+    ys = np.vstack([np.asarray(s, dtype=np.dtype("float64")) for s in y])
+    return grid.t, list(grid.resample(ys, max_gap=max_gap))
 
 
 def create_butterworth_hpf(cutoff_hz, slope_db_oct, timestamps, filter_out="sos"):
@@ -141,12 +211,55 @@ def create_butterworth_hpf(cutoff_hz, slope_db_oct, timestamps, filter_out="sos"
     return signal.butter(N, Wn, btype="highpass", output=filter_out)
 
 
+class FilterBank:
+    """Zero-phase Butterworth high-pass filtering with cached filter designs
+
+    Designs are cached by (cutoff, slope, sample rate), so buttord/butter run
+    once per distinct grid step instead of once per filtered signal. Several
+    channels on the same grid are filtered with one sosfiltfilt call:
+
+    >>> H_flt, H_P_flt = filter_bank.filter(t, np.vstack((H, H_P)))
+    """
+
+    def __init__(self, cutoff_hz=FILTER_CONF["cutoff"], slope_db_oct=FILTER_CONF["slope"]):
+        self.cutoff_hz = cutoff_hz
+        self.slope_db_oct = slope_db_oct
+        self._designs = dict()
+
+    def sos(self, t, cutoff_hz=None, slope_db_oct=None):
+        """Second-order sections of the filter for uniform time grid t"""
+        cutoff_hz = self.cutoff_hz if cutoff_hz is None else cutoff_hz
+        slope_db_oct = self.slope_db_oct if slope_db_oct is None else slope_db_oct
+        # rounding guards against float noise in grid step
+        fs_hz = round(1 / (t[1] - t[0]), 9)
+        key = (cutoff_hz, slope_db_oct, fs_hz)
+        if key not in self._designs:
+            self._designs[key] = create_butterworth_hpf(
+                cutoff_hz, slope_db_oct, [0, 1 / fs_hz]
+            )
+        return self._designs[key]
+
+    def filter(self, t, x, axis=-1, **design):
+        """Filter signal or stacked signals x along axis
+
+        Args:
+            t (np.ndarray): uniform time grid
+            x (np.ndarray): 1D signal or N-D array with channels along other axes
+            **design: cutoff_hz and/or slope_db_oct overriding the defaults
+        """
+        return signal.sosfiltfilt(self.sos(t, **design), x, axis=axis)
+
+
+filter_bank = FilterBank()
+
+
 def filter_array(t, x):
-    sos = create_butterworth_hpf(FILTER_CONF["cutoff"], FILTER_CONF["slope"], t)
-    return signal.sosfiltfilt(sos, x)
+    return filter_bank.filter(t, x)
 
 
 def plot_filter_response(cutoff_hz, slope_db_oct, fs_hz):
+    import matplotlib.pyplot as plt
+
     b, a = create_butterworth_hpf(cutoff_hz, slope_db_oct, fs_hz, filter_out="ba")
     w, h = signal.freqz(b, a, fs=fs_hz, worN=np.logspace(-4, -2, 50))
     plt.semilogx(w, 20 * np.log10(abs(h)))
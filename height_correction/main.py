@@ -1,15 +1,26 @@
 import pandas as pd
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
 import correction
 
-from visualizations import (
-    animate_filtered_scatter,
-    plot_filtering_masking,
-    plot_correlation,
-)
+from diagnostics import save_diagnostics
 from datum_processing import intervals_from_datum_files
-from config import DATA_DIR, DATUM_FILES, PSEUDOHEIGH_CONF
+from config import (
+    PSEUDOHEIGH_CONF,
+    N_WORKERS,
+    OUTPUT_FILE,
+    OUTPUT_CHUNK_ROWS,
+    PLOTTING_CONF,
+    DIAGNOSTICS_CONF,
+)
+
+
+# columns of every corrected interval that the correction itself relies on or adds,
+# the rest of datum columns are passed through
+OUTPUT_COLUMNS = ["datetime", "H", "P_hpa1", "H_P", "H_corrected"]
 
 
 def calculate_pseudo_height(df: pd.DataFrame):
@@ -22,11 +33,89 @@ def calculate_pseudo_height(df: pd.DataFrame):
     )
 
 
+def correct_interval(i: int, ch: pd.DataFrame):
+    """Full processing of one continuous interval
+
+    Returns:
+        pd.DataFrame: copy of the interval with H_P and H_corrected columns
+        correction.IntervalDiagnostics: intermediate arrays for plotting
+    """
+    ch = ch.copy()
+    calculate_pseudo_height(ch)
+    diag = correction.process_interval(ch, i)
+    if DIAGNOSTICS_CONF["save"]:
+        save_diagnostics(diag)
+    return ch, diag
+
+
+def correct_datum_intervals(n_workers=N_WORKERS) -> pd.DataFrame:
+    """Correct all intervals from datum files, distributing them across process pool
+
+    Diagnostic plots enabled in PLOTTING_CONF are rendered in a separate
+    background pool as soon as intervals are corrected.
+
+    Args:
+        n_workers (int | None): number of worker processes, None for one per CPU core,
+            1 to process intervals sequentially in the current process
+
+    Returns:
+        pd.DataFrame: all corrected intervals concatenated in original order,
+            empty with OUTPUT_COLUMNS if there are no valid intervals
+    """
+    intervals = list(intervals_from_datum_files())
+    progress = tqdm(total=len(intervals), desc="intervals")
+
+    render_executor = None
+    render_futures = []
+    if any(PLOTTING_CONF.values()):
+        # matplotlib is not needed for compute-only runs
+        from visualizations import render_diagnostics
+
+        render_executor = ProcessPoolExecutor(
+            max_workers=DIAGNOSTICS_CONF["render_workers"]
+        )
+
+    results = []
+
+    def collect(ch, diag):
+        results.append(ch)
+        progress.set_postfix(passes=diag.n_passes, changed=diag.n_changed.sum())
+        if render_executor is not None:
+            render_futures.append(render_executor.submit(render_diagnostics, diag))
+
+    if n_workers == 1:
+        for i, ch in enumerate(intervals):
+            collect(*correct_interval(i, ch))
+            progress.update()
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(correct_interval, i, ch) for i, ch in enumerate(intervals)
+            ]
+            for future in futures:
+                future.add_done_callback(lambda _: progress.update())
+            for future in futures:
+                collect(*future.result())
+    progress.close()
+
+    if render_executor is not None:
+        for future in tqdm(render_futures, desc="rendering"):
+            future.result()
+        render_executor.shutdown()
+
+    if not results:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    return pd.concat(results)
+
+
+def write_output(res: pd.DataFrame, path=OUTPUT_FILE):
+    """Same as res.to_csv(path), written in chunks of OUTPUT_CHUNK_ROWS to show progress"""
+    with open(path, "w", newline="") as f:
+        for start in tqdm(range(0, max(len(res), 1), OUTPUT_CHUNK_ROWS), desc="writing"):
+            res.iloc[start : start + OUTPUT_CHUNK_ROWS].to_csv(f, header=start == 0)
+
+
 if __name__ == "__main__":
-    res = pd.DataFrame()
-    for i, ch in enumerate(intervals_from_datum_files()):
-        calculate_pseudo_height(ch)
-        plot_filtering_masking(ch, i)
-        correction.process_interval(ch, i)
-        res = res.append(ch)
-    res.to_csv('datum_with_corrected_H.csv')
+    res = correct_datum_intervals()
+    print(f"writing {len(res)} records to {OUTPUT_FILE}...")
+    write_output(res)
@@ -0,0 +1,331 @@
+"""Causal height correction of streaming telemetry
+
+Unlike process_interval, StreamingHeightCorrector never looks at the whole
+interval. Records are consumed chunk by chunk, and corrected H is emitted with
+a fixed delay of half of the indicator smoothing window. Memory does not depend
+on how long the stream runs. Offline processing is approximated as follows:
+
+    - records are resampled to a uniform grid with STREAMING_CONF["step"]
+      as soon as all columns have values past the grid point
+    - zero-phase sosfiltfilt is replaced with sosfilt, keeping filter state between chunks
+    - the median of the filtered difference is replaced with an exponential moving average
+    - the centered moving average of the indicator is computed as a trailing one
+      and assigned to the window center, hence the delay
+    - barometric fit on both sides of the masked interval is replaced with an offset-only fit
+      H = b - a * ln(P / p0), with a from PSEUDOHEIGH_CONF, over the last clear fitting window
+
+Usage:
+
+>>> corrector = StreamingHeightCorrector()
+>>> for chunk in chunks:  # DataFrames with datetime, H and P_hpa1 columns
+...     corrected = corrector.push(chunk)
+>>> corrected = corrector.flush()
+"""
+
+import io
+import time
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+import filtering
+from datum_loader import datum_datetime
+from config import (
+    CORRECTION_CONF,
+    PSEUDOHEIGH_CONF,
+    INDICATOR_THRESHOLD,
+    STREAMING_CONF,
+)
+
+
+COLUMNS = ["H", "P_hpa1"]
+
+# master collection field -> datum column
+MASTER_FIELDS = {"H_m": "H", "P1_hPa": "P_hpa1"}
+
+
+def _empty_output() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "datetime": np.array([], dtype="datetime64[ns]"),
+            "H": np.array([]),
+            "H_P": np.array([]),
+            "indicator": np.array([]),
+            "indicator_mask": np.array([], dtype=bool),
+            "H_corrected": np.array([]),
+        }
+    )
+
+
+class StreamingHeightCorrector:
+    """Incremental GPS height correction with bounded latency and constant memory
+
+    Args:
+        step (float): grid step, sec
+        max_gap (float): a break in records longer than this (sec) ends the current
+            interval; everything pending is flushed and the state is reset
+    """
+
+    def __init__(self, step=STREAMING_CONF["step"], max_gap=STREAMING_CONF["max_gap"]):
+        self.step = step
+        self.max_gap = max_gap
+        self.sos = filtering.filter_bank.sos([0, step])
+        # sec -> t bin
+        self.ma_window = int(CORRECTION_CONF["ma_window"] / step)
+        self.fitting_window = int(CORRECTION_CONF["fitting_window"] / step)
+        self.center_alpha = step / STREAMING_CONF["center_window"]
+        # centered smoothing window of a sample extends this many samples into the future
+        self.delay = self.ma_window - 1 - self.ma_window // 2
+        self.reset()
+
+    @property
+    def latency(self) -> float:
+        """Delay between a grid point and emission of its corrected value, sec"""
+        return self.delay * self.step
+
+    def reset(self):
+        """Forget everything, the next record starts a new interval"""
+        self._t0 = None  # datetime64 of the first record in interval, grid is counted from it
+        self._last_t = None  # time of the last record, sec from t0
+        self._t_grid = None  # next grid point, sec from t0
+        # per column valid (t, value) points not yet consumed by grid
+        self._points = [(np.array([]), np.array([])) for _ in COLUMNS]
+        self._filter_zi = None
+        self._center_zi = None
+        # one-sided differences from the start of the smoothing window of the next sample to emit
+        self._ma_buffer = np.array([])
+        # grid samples waiting for their smoothing window to complete
+        self._pending_t = np.array([])
+        self._pending_H = np.array([])
+        self._pending_H_P = np.array([])
+        # H - H_P in the last clear fitting window
+        self._clear_offsets = np.array([])
+
+    def push(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Consume new records with datetime, H and P_hpa1 columns (NaN for missing values)
+
+        Returns:
+            pd.DataFrame: corrected grid samples that became ready
+        """
+        if df.empty:
+            return _empty_output()
+        dts = df["datetime"].to_numpy().astype("datetime64[ns]")
+        values = df[COLUMNS].to_numpy(dtype=float)
+
+        outputs = []
+        if self._t0 is None:
+            self._t0 = dts[0]
+        t = filtering.timedelta2sec(dts - self._t0)
+        last_t = t[0] if self._last_t is None else self._last_t
+        breaks = np.nonzero(np.diff(np.concatenate(([last_t], t))) > self.max_gap)[0]
+        bounds = np.unique(np.r_[0, breaks, len(t)])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start in breaks:
+                outputs.append(self.flush())
+                self._t0 = dts[start]
+                t = filtering.timedelta2sec(dts - self._t0)
+            outputs.append(self._push_records(t[start:end], values[start:end]))
+        return pd.concat(outputs, ignore_index=True)
+
+    def flush(self) -> pd.DataFrame:
+        """Emit all pending samples as if the interval ended here, and reset the state"""
+        out = _empty_output()
+        if len(self._pending_t):
+            # smoothing window is padded with the last value, same as offline one at the interval end
+            self._ma_buffer = np.concatenate(
+                (self._ma_buffer, np.full(self.delay, self._ma_buffer[-1]))
+            )
+            out = self._emit()
+        self.reset()
+        return out
+
+    def _push_records(self, t, values) -> pd.DataFrame:
+        self._last_t = t[-1]
+        for i, (t_col, v_col) in enumerate(self._points):
+            valid = ~np.isnan(values[:, i])
+            self._points[i] = (
+                np.concatenate((t_col, t[valid])),
+                np.concatenate((v_col, values[valid, i])),
+            )
+        if any(len(t_col) == 0 for t_col, _ in self._points):
+            return _empty_output()
+        if self._t_grid is None:
+            self._t_grid = max(t_col[0] for t_col, _ in self._points)
+
+        # grid points already covered with valid values of all columns
+        t_covered = min(t_col[-1] for t_col, _ in self._points)
+        if t_covered < self._t_grid:
+            return _empty_output()
+        t_grid = self._t_grid + self.step * np.arange(
+            int((t_covered - self._t_grid) / self.step) + 1
+        )
+        self._t_grid = t_grid[-1] + self.step
+        H, P = [np.interp(t_grid, t_col, v_col) for t_col, v_col in self._points]
+        for i, (t_col, v_col) in enumerate(self._points):
+            # the last point before the next grid point is needed to interpolate it
+            keep_from = max(np.searchsorted(t_col, self._t_grid, side="right") - 1, 0)
+            self._points[i] = (t_col[keep_from:], v_col[keep_from:])
+
+        return self._process_grid(t_grid, H, P)
+
+    def _process_grid(self, t, H, P) -> pd.DataFrame:
+        H_P = PSEUDOHEIGH_CONF["H0"] - PSEUDOHEIGH_CONF["a"] * np.log(
+            P / PSEUDOHEIGH_CONF["p0"]
+        )
+
+        channels = np.vstack((H, H_P))
+        if self._filter_zi is None:
+            # steady state for the first values, so that the filter does not ring at start
+            self._filter_zi = (
+                signal.sosfilt_zi(self.sos)[:, np.newaxis, :] * channels[np.newaxis, :, :1]
+            )
+        (H_flt, H_P_flt), self._filter_zi = signal.sosfilt(
+            self.sos, channels, axis=-1, zi=self._filter_zi
+        )
+
+        diff = H_P_flt - H_flt
+        b, a = [self.center_alpha], [1, self.center_alpha - 1]
+        if self._center_zi is None:
+            self._center_zi = signal.lfilter_zi(b, a) * diff[0]
+        center, self._center_zi = signal.lfilter(b, a, diff, zi=self._center_zi)
+        one_sided_diff = np.abs(diff - center)
+
+        if not len(self._ma_buffer):
+            # smoothing window of the first sample is padded with its value
+            self._ma_buffer = np.full(self.ma_window // 2, one_sided_diff[0])
+        self._ma_buffer = np.concatenate((self._ma_buffer, one_sided_diff))
+        self._pending_t = np.concatenate((self._pending_t, t))
+        self._pending_H = np.concatenate((self._pending_H, H))
+        self._pending_H_P = np.concatenate((self._pending_H_P, H_P))
+        return self._emit()
+
+    def _emit(self) -> pd.DataFrame:
+        """Correct and emit pending samples with complete smoothing windows"""
+        n_ready = len(self._ma_buffer) - self.ma_window + 1
+        if n_ready <= 0:
+            return _empty_output()
+        cs = np.concatenate(([0], np.cumsum(self._ma_buffer)))
+        indicator = (cs[self.ma_window :] - cs[: -self.ma_window]) / self.ma_window
+        indicator_mask = indicator > INDICATOR_THRESHOLD
+
+        t = self._pending_t[:n_ready]
+        H = self._pending_H[:n_ready]
+        H_P = self._pending_H_P[:n_ready]
+        self._ma_buffer = self._ma_buffer[n_ready:]
+        self._pending_t = self._pending_t[n_ready:]
+        self._pending_H = self._pending_H[n_ready:]
+        self._pending_H_P = self._pending_H_P[n_ready:]
+
+        # H = b - a * ln(P / p0) = H_P + (b - H0), so offset-only fit is the mean of H - H_P;
+        # each masked sample uses clear samples preceding it
+        offsets = np.concatenate((self._clear_offsets, (H - H_P)[~indicator_mask]))
+        n_clear = len(self._clear_offsets) + np.cumsum(~indicator_mask) - ~indicator_mask
+        cs = np.concatenate(([0], np.cumsum(offsets)))
+        window_start = np.maximum(n_clear - self.fitting_window, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offset = (cs[n_clear] - cs[window_start]) / (n_clear - window_start)
+        # without clear samples so far H is left as is
+        correct = indicator_mask & (n_clear > 0)
+        H_corrected = np.where(correct, H_P + offset, H)
+        self._clear_offsets = offsets[-self.fitting_window :]
+
+        return pd.DataFrame(
+            {
+                "datetime": self._t0 + np.round(t * 1e9).astype("timedelta64[ns]"),
+                "H": H,
+                "H_P": H_P,
+                "indicator": indicator,
+                "indicator_mask": indicator_mask,
+                "H_corrected": H_corrected,
+            }
+        )
+
+
+def correct_dataframe_chunks(
+    chunks: Iterable[pd.DataFrame], corrector: StreamingHeightCorrector = None
+) -> Iterator[pd.DataFrame]:
+    """Correct stream of DataFrames with datetime, H and P_hpa1 columns, yielding ready samples"""
+    corrector = corrector or StreamingHeightCorrector()
+    for chunk in chunks:
+        out = corrector.push(chunk)
+        if not out.empty:
+            yield out
+    out = corrector.flush()
+    if not out.empty:
+        yield out
+
+
+READ_BLOCK_BYTES = 1 << 20
+
+
+def _csv_lines_chunks(header: bytes, lines: bytes, chunksize: int) -> Iterator[pd.DataFrame]:
+    for chunk in pd.read_csv(io.BytesIO(header + lines), chunksize=chunksize):
+        chunk.insert(0, "datetime", datum_datetime(chunk))
+        yield chunk
+
+
+def datum_csv_chunks(
+    path, chunksize=STREAMING_CONF["chunksize"], follow=False, poll_interval=STREAMING_CONF["poll_interval"]
+) -> Iterator[pd.DataFrame]:
+    """Read datum .csv file in chunks of at most 'chunksize' records, adding datetime column
+
+    With follow=True the file is read as it grows (like tail -f) and the generator never ends:
+    only complete lines are parsed, the incomplete trailing one is held back until its newline
+    is written, and the file is polled every 'poll_interval' sec for new data.
+    """
+    header = None
+    tail = b""  # incomplete trailing line
+    with open(str(path), "rb") as f:
+        while True:
+            block = f.read(READ_BLOCK_BYTES)
+            if not block:
+                if not follow:
+                    break
+                time.sleep(poll_interval)
+                continue
+            lines, newline, tail = (tail + block).rpartition(b"\n")
+            if not newline:
+                continue
+            lines += newline
+            if header is None:
+                header, _, lines = lines.partition(b"\n")
+                header += b"\n"
+            if lines.strip():
+                yield from _csv_lines_chunks(header, lines, chunksize)
+    # without follow, the last line of the file is complete even without newline
+    if header is not None and tail.strip():
+        yield from _csv_lines_chunks(header, tail, chunksize)
+
+
+def document_chunks(docs: Iterable[dict], chunksize=STREAMING_CONF["chunksize"]) -> Iterator[pd.DataFrame]:
+    """Group master collection documents (e.g. from cursor or change stream) into DataFrame chunks"""
+    batch = []
+    for doc in docs:
+        batch.append(
+            {
+                "datetime": doc["utc_dt"],
+                **{column: doc.get(field, np.nan) for field, column in MASTER_FIELDS.items()},
+            }
+        )
+        if len(batch) == chunksize:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from config import DATA_DIR, DATUM_FILES
+
+    # python streaming.py [path/to/datum.csv] [--follow]
+    follow = "--follow" in sys.argv[1:]
+    paths = [arg for arg in sys.argv[1:] if arg != "--follow"]
+    path = paths[0] if paths else DATA_DIR / DATUM_FILES[0]
+    corrector = StreamingHeightCorrector()
+    print(f"latency {corrector.latency} sec")
+    for out in correct_dataframe_chunks(datum_csv_chunks(path, follow=follow), corrector):
+        print(out.iloc[[-1]].to_string(header=False, index=False))
@@ -8,15 +8,20 @@ from scipy.stats import norm
 from scipy.optimize import curve_fit
 from math import pi
 
+import pandas as pd
+
 import filtering
 import correction
 
+from diagnostics import load_diagnostics
+
 from config import (
-    FILTER_CONF,
     CORRECTION_CONF,
     TEMP_DIFF_SAMPLE_SAVING,
     TEMP_DIFF_SAMPLE_FILE,
     INDICATOR_THRESHOLD,
+    PLOTTING_CONF,
+    DIAGNOSTICS_CONF,
 )
 
 
@@ -29,13 +34,11 @@ def animate_filtered_scatter(df, fig=None):
 
     t, (H, P) = filtering.to_uniform_grid(df.loc[:, ["datetime", "H", "P_hpa1"]])
 
-    sos = filtering.create_butterworth_hpf(
-        FILTER_CONF["cutoff"], FILTER_CONF["slope"], t
-    )
-    H_flt = filtering.normalize_array(filtering.filter_array(H, sos))
-    P_flt = filtering.normalize_array(filtering.filter_array(-P, sos))
+    H_flt, P_flt = filtering.filter_bank.filter(t, np.vstack((H, -P)))
+    H_flt = filtering.normalize_array(H_flt)
+    P_flt = filtering.normalize_array(P_flt)
 
-    trail_length = int(CORRECTION_CONF["window"] / (t[1] - t[0]))
+    trail_length = int(CORRECTION_CONF["correlation_window"] / (t[1] - t[0]))
     scmap = cm.ScalarMappable(
         norm=Normalize(0, trail_length), cmap=plt.get_cmap("cool")
     )
@@ -60,11 +63,9 @@ def plot_correlation(df, fig=None):
     ax2 = ax.twinx()
 
     t, (H, P) = filtering.to_uniform_grid(df.loc[:, ["datetime", "H", "P_hpa1"]])
-    sos = filtering.create_butterworth_hpf(
-        FILTER_CONF["cutoff"], FILTER_CONF["slope"], t
-    )
-    H_flt = filtering.normalize_array(filtering.filter_array(H, sos))
-    P_flt = filtering.normalize_array(filtering.filter_array(-P, sos))
+    H_flt, P_flt = filtering.filter_bank.filter(t, np.vstack((H, -P)))
+    H_flt = filtering.normalize_array(H_flt)
+    P_flt = filtering.normalize_array(P_flt)
 
     ax.set_xlabel("time, s")
 
@@ -134,7 +135,7 @@ def plot_patch_collection_from_mask(t, mask, ax):
         ax.add_collection(patches)
 
 
-def plot_filtering_masking(df, i: int, fig=None):
+def plot_filtering_masking(diag, fig=None):
     if fig is None:
         fig = plt.figure()
     fig.clf()
@@ -146,16 +147,12 @@ def plot_filtering_masking(df, i: int, fig=None):
     ax_flt = fig.add_subplot(n_plots, 1, 2, sharex=ax_H)
     ax_thresh = fig.add_subplot(n_plots, 1, 3, sharex=ax_H)
 
-    t_start = df["datetime"].iloc[0]
-    t_H_raw, H_raw = filtering.extract_time_series(df.loc[:, ["datetime", "H"]])
-    t_P_raw, P_raw = filtering.extract_time_series(df.loc[:, ["datetime", "H_P"]])
+    t_start = pd.Timestamp(diag.t_start)
 
-    t, (H, P) = filtering.to_uniform_grid(df.loc[:, ["datetime", "H", "H_P"]])
-    H_flt = filtering.filter_array(t, H)
-    P_flt = filtering.filter_array(t, P)
+    t, H, P = diag.t, diag.H, diag.H_P
 
-    H_flt_norm = H_flt
-    P_flt_norm = P_flt
+    H_flt_norm = diag.H_flt
+    P_flt_norm = diag.H_P_flt
 
     if TEMP_DIFF_SAMPLE_SAVING:
         # this is used to save difference between filtered heights
@@ -164,7 +161,7 @@ def plot_filtering_masking(df, i: int, fig=None):
         with open(TEMP_DIFF_SAMPLE_FILE, "a") as f:
             f.writelines([str(x) + "\n" for x in rawdiff])
 
-    t_ind, indicator = correction.indicator(t, H_flt_norm, P_flt_norm)
+    t_ind, indicator = diag.t_ind, diag.indicator
     indicator_mask = np.greater(indicator, INDICATOR_THRESHOLD)
 
     # print(f"indicator mean = {np.mean(indicator)}; std = {np.std(indicator)}")
@@ -220,4 +217,60 @@ def plot_filtering_masking(df, i: int, fig=None):
 
     # ax_H.set_xlim(20000, 25000) # manual for 2013 flight 3
 
-    plt.savefig(f"pics/pic-interval-{i}")
+    plt.savefig(f"pics/pic-interval-{diag.interval_idx}")
+
+
+def plot_H_histogram(diag, fig=None):
+    if fig is None:
+        fig = plt.figure()
+    fig.clf()
+    ax = fig.add_subplot()
+    ax.hist(diag.H_flt, bins=70, range=[-20, 20])
+    sigma = np.std(diag.H_flt)
+    ax.set_title(rf"$\sigma = {sigma}$")
+    fig.savefig(f"pics/H-hist-{diag.interval_idx}")
+
+
+def plot_barometric_fits(diag, fig=None):
+    if fig is None:
+        fig = plt.figure()
+    fits = diag.fits
+    for k in range(len(fits.intervals)):
+        fig.clf()
+        ax = fig.add_subplot()
+        fit_points = np.r_[slice(*fits.left[k]), slice(*fits.right[k])]
+        ax.plot(diag.P[fit_points], diag.H[fit_points], "b.")
+        interval = slice(*fits.intervals[k])
+        ax.plot(diag.P[interval], diag.H[interval], "rx")
+        if fits.ok[k]:
+            smooth_x = np.linspace(np.min(diag.P[fit_points]), np.max(diag.P[fit_points]), 1000)
+            ax.plot(smooth_x, fits.b[k] - fits.a[k] * np.log(smooth_x), "-r")
+        ax.set_title(f"RMS = {fits.rms[k]:.2f} m on {fits.n_points[k]} points")
+        fig.savefig(f"pics/pic-barometric-corr-{diag.interval_idx}-{k}")
+
+
+def render_diagnostics(diag):
+    """Render all plots enabled in PLOTTING_CONF for one interval
+
+    Args:
+        diag (correction.IntervalDiagnostics | str | Path): diagnostics or path to saved ones
+    """
+    if not isinstance(diag, correction.IntervalDiagnostics):
+        diag = load_diagnostics(diag)
+    fig = plt.figure()
+    if PLOTTING_CONF["H_histogram"]:
+        plot_H_histogram(diag, fig)
+    if PLOTTING_CONF["filtering_masking"]:
+        plot_filtering_masking(diag, fig)
+    if PLOTTING_CONF["barometric_height_correction"]:
+        plot_barometric_fits(diag, fig)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    # render plots from saved diagnostics: python visualizations.py diagnostics/*.npz
+    with ProcessPoolExecutor(max_workers=DIAGNOSTICS_CONF["render_workers"]) as executor:
+        list(executor.map(render_diagnostics, sys.argv[1:]))
@@ -1,17 +1,20 @@
 """Module for parsing telemetry data from datum tables and storing in local MongoDB"""
 
 from pymongo import MongoClient
-import pandas as pd
 
 from tqdm import tqdm
 
-from datum_querying import datum_datetime
+from datum_loader import read_datum
+from telemetry_querying.indexes import ensure_indexes
+from telemetry_querying.geo import geojson_points
 
 # assuming Mongo is running as mongod process/service and listening on localhost port 27017
 # for installation see https://docs.mongodb.com/manual/administration/install-community/
 # for restoring data from dump see README.md
 client = MongoClient()
 datum_telemetry_collection = client.sphere_telemetry.from_datum_tables
+# records are upserted by utc_dt, one by one
+ensure_indexes(client.sphere_telemetry)
 
 columns_to_drop = {
     'Gqi',
@@ -69,14 +72,13 @@ for datum_filename in datum_filenames:
     print(f'loading datum from {datum_path}...')
     datum_filename_id = datum_filenames_collection.find_one({'filename': datum_filename})['id']
 
-    datum = pd.read_csv(datum_path)
-    datum.insert(0, 'utc_dt', datum_datetime(datum))
-    datum.set_index('utc_dt', inplace=True, drop=False)
+    datum = read_datum(datum_path)
+    datum.set_index('datetime', inplace=True, drop=False)
     datum.index.name = 'local_dt_index'
-    datum.drop(columns=['year', 'month', 'day', 'time'], inplace=True)
 
     datum.drop(columns=columns_to_drop, inplace=True)
     datum.rename(columns=column_name_unification, inplace=True)
+    datum['position'] = geojson_points(datum['N_lat'], datum['E_lon'])  # None is dropped with NaNs
     for _, record_series in tqdm(datum.iterrows()):
         record_series.dropna(inplace=True)
         record = record_series.to_dict()
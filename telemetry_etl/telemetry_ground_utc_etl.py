@@ -0,0 +1,142 @@
+"""Module for backfilling utc_dt of ground log records from local_dt and GPS_stamp
+
+Ground log records (see telemetry_parsing_etl.py) are keyed by local_dt, UTC is present
+only as 6-digit GPS_stamp (HHMMSS, no date). For each log source:
+
+    - local_dt - utc offset is estimated as the median of local time of day minus
+      GPS time of day over all stamped records, assuming it is within half a day
+    - UTC date of a stamped record is chosen so that utc_dt is the closest to local_dt - offset,
+      which handles midnight rollover of GPS stamps and local clock alike
+    - stamps inconsistent with their neighbours (offset deviating from the rolling median
+      by more than STAMP_TOLERANCE_SEC) are considered broken
+    - records with missing or broken stamps get utc_dt = local_dt - offset, with the offset
+      interpolated from the neighbouring stamped records, and are flagged with utc_dt_estimated
+
+All records are read in one pass, converted with numpy and written back in bulk.
+"""
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tqdm import tqdm
+
+from telemetry_querying.indexes import ensure_indexes
+
+
+SEC_NS = 10 ** 9
+DAY_NS = 86400 * SEC_NS
+
+STAMP_TOLERANCE_SEC = 120
+STAMP_WINDOW = 601  # stamped records in rolling median of the offset
+
+WRITE_BATCH_SIZE = 10000
+
+
+def gps_stamp_seconds(stamps: pd.Series) -> np.ndarray:
+    """Seconds of day from HHMMSS GPS stamps, NaN for missing and malformed ones"""
+    stamps = pd.to_numeric(stamps, errors='coerce').to_numpy(dtype=float)
+    hours, minutes, seconds = stamps // 10000, stamps // 100 % 100, stamps % 100
+    valid = (stamps >= 0) & (hours < 24) & (minutes < 60) & (seconds < 60)
+    return np.where(valid, hours * 3600 + minutes * 60 + seconds, np.nan)
+
+
+def local_to_utc(local_ns: np.ndarray, stamp_sec: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """UTC for records of one log source
+
+    Args:
+        local_ns (np.ndarray): sorted local_dt as int64 ns since epoch
+        stamp_sec (np.ndarray): GPS time of day in sec, NaN where missing (see gps_stamp_seconds)
+
+    Returns:
+        np.ndarray: utc_dt as int64 ns since epoch
+        np.ndarray: bool mask of records with estimated utc_dt;
+        None if there are no usable stamps
+    """
+    stamped = ~np.isnan(stamp_sec)
+    if not stamped.any():
+        return None
+    stamp_ns = np.where(stamped, stamp_sec, 0).astype(np.int64) * SEC_NS
+
+    # local - utc modulo day, unwrapped around the first stamped record to take median
+    offset_mod_day = (local_ns % DAY_NS - stamp_ns) % DAY_NS
+    ref = offset_mod_day[stamped][0]
+    offset_mod_day = (offset_mod_day - ref + DAY_NS // 2) % DAY_NS - DAY_NS // 2 + ref
+    # local clock is assumed to be set to some time zone, so that the offset is within half a day
+    source_offset = (int(np.median(offset_mod_day[stamped])) + DAY_NS // 2) % DAY_NS - DAY_NS // 2
+
+    # the time with stamp's time of day closest to approximate utc
+    approx_utc = local_ns - source_offset
+    utc = approx_utc + (stamp_ns - approx_utc % DAY_NS + DAY_NS // 2) % DAY_NS - DAY_NS // 2
+
+    offset = local_ns - utc
+    rolling_offset = (
+        pd.Series(offset[stamped]).rolling(STAMP_WINDOW, center=True, min_periods=1).median().to_numpy()
+    )
+    valid = stamped.copy()
+    valid[stamped] = np.abs(offset[stamped] - rolling_offset) <= STAMP_TOLERANCE_SEC * SEC_NS
+    if not valid.any():
+        return None
+
+    # interpolation in float is done relative to the first record to keep ns precision
+    t = (local_ns - local_ns[0]).astype(float)
+    estimated_offset = np.round(np.interp(t, t[valid], offset[valid].astype(float))).astype(np.int64)
+    utc = np.where(valid, utc, local_ns - estimated_offset)
+    return utc, ~valid
+
+
+def read_ground_times(coll: Collection) -> pd.DataFrame:
+    """_id, source_id, local_dt (int64 ns) and GPS_stamp of all records, sorted by source and local_dt"""
+    docs = coll.find(
+        {'local_dt': {'$exists': True}}, {'_id': True, 'source_id': True, 'local_dt': True, 'GPS_stamp': True}
+    ).batch_size(WRITE_BATCH_SIZE)
+    df = pd.DataFrame(list(tqdm(docs, desc='reading')), columns=['_id', 'source_id', 'local_dt', 'GPS_stamp'])
+    df['local_dt'] = pd.to_datetime(df['local_dt']).to_numpy().astype('datetime64[ns]').astype(np.int64)
+    return df.sort_values(['source_id', 'local_dt'], kind='mergesort', ignore_index=True)
+
+
+def write_utc(coll: Collection, ids: np.ndarray, utc_ns: np.ndarray, estimated: np.ndarray):
+    utc_dts = pd.to_datetime(utc_ns).to_pydatetime()
+    for start in tqdm(range(0, len(ids), WRITE_BATCH_SIZE), desc='writing'):
+        requests = []
+        for id_, utc_dt, is_estimated in zip(
+            ids[start:start + WRITE_BATCH_SIZE],
+            utc_dts[start:start + WRITE_BATCH_SIZE],
+            estimated[start:start + WRITE_BATCH_SIZE],
+        ):
+            if is_estimated:
+                update = {'$set': {'utc_dt': utc_dt, 'utc_dt_estimated': True}}
+            else:
+                update = {'$set': {'utc_dt': utc_dt}, '$unset': {'utc_dt_estimated': ''}}
+            requests.append(UpdateOne({'_id': id_}, update))
+        coll.bulk_write(requests, ordered=False)
+
+
+def backfill_ground_utc(coll: Collection):
+    df = read_ground_times(coll)
+    if df.empty:
+        return
+    stamp_sec = gps_stamp_seconds(df['GPS_stamp'])
+    local_ns = df['local_dt'].to_numpy()
+    # source_id may be missing, all such records are treated as one source
+    source_ids = df['source_id'].fillna(-1).astype(int).to_numpy()
+    bounds = np.r_[0, np.nonzero(source_ids[1:] != source_ids[:-1])[0] + 1, len(df)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        converted = local_to_utc(local_ns[start:end], stamp_sec[start:end])
+        if converted is None:
+            print(f'source {source_ids[start]}: no usable GPS stamps, {end - start} records skipped')
+            continue
+        utc_ns, estimated = converted
+        print(f'source {source_ids[start]}: {end - start} records, {estimated.sum()} estimated')
+        write_utc(coll, df['_id'].to_numpy()[start:end], utc_ns, estimated)
+
+
+if __name__ == "__main__":
+    # assuming Mongo is running as mongod process/service and listening on localhost port 27017
+    # for restoring data from dump see README.md
+    client = MongoClient()
+    ensure_indexes(client.sphere_telemetry)
+    backfill_ground_utc(client.sphere_telemetry.from_ground_logs)
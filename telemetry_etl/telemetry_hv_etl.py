@@ -1,55 +1,110 @@
+"""Module for converting HV channel currents and HV -> VIP -> PMT mapping to dense array store
+
+Store layout (read with telemetry_querying.hv_currents.HVCurrentStore):
+
+    store_dir/
+        utc_dt.npy      // int64, ns since epoch, sorted
+        currents.npy    // float64, time x channel, NaN for missing values
+        channels.npy    // int64, HV channel number of each currents column
+        mapping.npz     // per-year HV -> PMT and HV -> VIP mapping and VIP error masks
+"""
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from pymongo import MongoClient
-from datetime import datetime
+from numpy.lib.format import open_memmap
 from tqdm import tqdm
 
 
-client = MongoClient()
-
-
 DATADIR = Path('/home/njvh/Documents/Science/sphere/telemetry/data/other sources')
-
-
-coll = client.sphere_telemetry.hv_vip_pmt_mapping
-
-
-df = pd.read_csv(DATADIR / 'hv_errors.csv')
-df['vip'] = df['vip'] + 1
-df.set_index('vip', inplace=True)
-df = df.applymap(lambda s: s == 'ERR')
-vip_errors = df.to_dict('dict')
-# print(vip_errors['2013'][33])
-
-
-df = pd.read_csv(DATADIR / 'hv_mapping.csv')
-df['hv'] = df['hv']
-df.set_index('hv', inplace=True)
-df = df.applymap(lambda s: str(s))
-hv_mapping = dict()
-for i, year in enumerate([2010, 2011, 2012]):
-    df_temp = df.iloc[:, 2*i:(2*i+2)]
-    df_temp.columns = ['pmt', 'vip']
-    hv_mapping[year] = {k: v for k, v in df_temp.to_dict('index').items() if '-1' not in list(v.values())}
-hv_mapping[2013] = hv_mapping[2012]
-# print(hv_mapping)
-
-
-
-
-
-exit()
-
-
-coll = client.sphere_telemetry.hv
-
-df = pd.read_csv(DATADIR / 'currents_corrected.txt')
-for i, ser in tqdm(df.iterrows(), total=len(df.index)):
-    year = ser['year']
-    hh, mm, ss = str(ser['HHMMSS']).split(':')
-    dt = datetime(year=year, month=ser['month'], day=ser['day'], hour=int(hh), minute=int(mm), second=int(ss))
-    currents = {k[3:]: v for k, v in ser.drop(labels=['year', 'month', 'day', 'flight', 'HHMMSS']).to_dict().items()}
-    coll.insert_one({
-        'utc_time': dt,
-        'I_per_hv': currents,
-    })
+HV_STORE_DIR = DATADIR / 'hv_store'
+
+MAPPING_YEARS = [2010, 2011, 2012]  # years with own columns in hv_mapping.csv
+SAME_MAPPING_AS = {2013: 2012}
+
+CURRENTS_CHUNK_SIZE = 100000  # rows of currents file converted at once
+TIME_COLUMNS = ['year', 'month', 'day', 'flight', 'HHMMSS']
+
+
+def read_mapping(datadir: Path = DATADIR) -> dict:
+    """Per-year HV -> PMT, HV -> VIP mapping and VIP error masks as dense arrays
+
+    Returns:
+        dict: 'years' (n_years), 'hv' (n_hv) — HV channel numbers,
+            'pmt' and 'vip' (n_years x n_hv) — mapped PMT and VIP numbers, -1 if not connected,
+            'vip_error' (n_years x n_vip) — True where VIP was erroneous, indexed by VIP number
+    """
+    mapping = pd.read_csv(datadir / 'hv_mapping.csv').set_index('hv').sort_index()
+    errors = pd.read_csv(datadir / 'hv_errors.csv')
+    errors['vip'] = errors['vip'] + 1
+    errors = errors.set_index('vip')
+
+    years = MAPPING_YEARS + list(SAME_MAPPING_AS)
+    hv = mapping.index.to_numpy(dtype=np.int64)
+    # pmt and vip columns go in pairs, one pair per year
+    pmt_by_year = {year: mapping.iloc[:, 2 * i].to_numpy(dtype=np.int64) for i, year in enumerate(MAPPING_YEARS)}
+    vip_by_year = {year: mapping.iloc[:, 2 * i + 1].to_numpy(dtype=np.int64) for i, year in enumerate(MAPPING_YEARS)}
+    for year, same_as in SAME_MAPPING_AS.items():
+        pmt_by_year[year] = pmt_by_year[same_as]
+        vip_by_year[year] = vip_by_year[same_as]
+    pmt = np.vstack([pmt_by_year[year] for year in years])
+    vip = np.vstack([vip_by_year[year] for year in years])
+    # channel is not connected if either of its pmt or vip is missing
+    not_connected = (pmt == -1) | (vip == -1)
+    pmt[not_connected] = -1
+    vip[not_connected] = -1
+
+    n_vip = max(int(vip.max()), int(errors.index.max())) + 1
+    vip_error = np.zeros((len(years), n_vip), dtype=bool)
+    for i, year in enumerate(years):
+        if str(year) in errors.columns:
+            vip_error[i, errors.index.to_numpy()] = (errors[str(year)].astype(str) == 'ERR').to_numpy()
+
+    return {'years': np.array(years), 'hv': hv, 'pmt': pmt, 'vip': vip, 'vip_error': vip_error}
+
+
+def currents_utc_dt(df: pd.DataFrame) -> np.ndarray:
+    """Timestamps (int64 ns) from year, month, day and HHMMSS ('HH:MM:SS') columns"""
+    dates = pd.to_datetime(df[['year', 'month', 'day']])
+    return (dates + pd.to_timedelta(df['HHMMSS'].astype(str))).to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+
+def build_hv_store(datadir: Path = DATADIR, store_dir: Path = HV_STORE_DIR):
+    store_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(store_dir / 'mapping.npz', **read_mapping(datadir))
+
+    currents_path = datadir / 'currents_corrected.txt'
+    header = pd.read_csv(currents_path, nrows=0).columns
+    current_columns = [column for column in header if column not in TIME_COLUMNS]
+    # current columns are named with 3-character prefix followed by HV channel number
+    channels = np.array([int(column[3:]) for column in current_columns], dtype=np.int64)
+    with open(currents_path) as f:
+        # read_csv skips blank lines, they must not be counted
+        n_rows = sum(1 for line in f if line.strip()) - 1
+
+    utc_dt = open_memmap(store_dir / 'utc_dt.npy', mode='w+', dtype=np.int64, shape=(n_rows,))
+    currents = open_memmap(
+        store_dir / 'currents.npy', mode='w+', dtype=np.float64, shape=(n_rows, len(channels))
+    )
+    row = 0
+    chunks = pd.read_csv(
+        currents_path, chunksize=CURRENTS_CHUNK_SIZE, dtype={column: np.float64 for column in current_columns}
+    )
+    for chunk in tqdm(chunks, total=int(np.ceil(n_rows / CURRENTS_CHUNK_SIZE))):
+        utc_dt[row:row + len(chunk)] = currents_utc_dt(chunk)
+        currents[row:row + len(chunk)] = chunk[current_columns].to_numpy()
+        row += len(chunk)
+    if row != n_rows:
+        raise ValueError(f"Expected {n_rows} rows in '{currents_path}', read {row}; store in {store_dir} is incomplete")
+
+    if np.any(np.diff(utc_dt) < 0):
+        order = np.argsort(utc_dt, kind='stable')
+        utc_dt[:] = utc_dt[order]
+        for start in range(0, len(channels), 8):
+            currents[:, start:start + 8] = currents[order, start:start + 8]
+    np.save(store_dir / 'channels.npy', channels)
+    del utc_dt, currents  # flush memmaps
+
+
+if __name__ == "__main__":
+    build_hv_store()
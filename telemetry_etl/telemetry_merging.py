@@ -2,25 +2,44 @@ from pymongo import MongoClient
 
 from tqdm import tqdm
 
+from telemetry_querying.rollups import update_rollups
+from telemetry_querying.buckets import update_buckets
+from telemetry_querying.indexes import ensure_indexes, check_query_plans
+from telemetry_querying.geo import position_expr
+
 # assuming Mongo is running as mongod process/service and listening on localhost port 27017
 # for installation see https://docs.mongodb.com/manual/administration/install-community/
 # for restoring data from dump see README.md
 client = MongoClient()
 datum = client.sphere_telemetry.from_datum_tables
 master = client.sphere_telemetry.master
+# records are upserted by utc_dt, one by one
+ensure_indexes(client.sphere_telemetry)
 
 
 pipeline = [
     {'$match': {'utc_dt': {'$exists': True}}},
     {'$project': {'local_dt': 0, 'GPS_stamp': 0, '_id': 0}},
-    {'$addFields': {'from_datum': {'$literal': True}}},
+    {'$addFields': {'from_datum': {'$literal': True}, 'position': position_expr()}},
 ]
 
 total = datum.aggregate(pipeline + [{"$count": "N"}]).next()['N']
 
+merged_start, merged_end = None, None
 for doc in tqdm(datum.aggregate(pipeline), total=total):
     master.update_one(
         filter={'utc_dt': doc['utc_dt']},
         update={"$setOnInsert": doc},
         upsert=True
     )
+    merged_start = doc['utc_dt'] if merged_start is None else min(merged_start, doc['utc_dt'])
+    merged_end = doc['utc_dt'] if merged_end is None else max(merged_end, doc['utc_dt'])
+
+# keep precomputed rollups and buckets (see telemetry_querying.rollups and .buckets) consistent with merged data
+if merged_start is not None:
+    print('updating rollups...')
+    update_rollups(master, merged_start, merged_end, progress=True)
+    print('updating buckets...')
+    update_buckets(master, merged_start, merged_end, progress=True)
+
+check_query_plans(client.sphere_telemetry)
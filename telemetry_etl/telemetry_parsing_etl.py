@@ -7,12 +7,16 @@ import pandas as pd
 from tqdm import tqdm
 
 from sphere_log_parser import yield_log_records_as_dicts
+from telemetry_querying.indexes import ensure_indexes
+from telemetry_querying.geo import record_position
 
 # assuming Mongo is running as mongod process/service and listening on localhost port 27017
 # for installation see https://docs.mongodb.com/manual/administration/install-community/
 # for restoring data from dump see README.md
 client = MongoClient()
 ground_telemetry_collection = client.sphere_telemetry.from_ground_logs
+# records are upserted by local_dt, one by one
+ensure_indexes(client.sphere_telemetry)
 
 
 log_filenames = [
@@ -43,12 +47,16 @@ for log_filename in log_filenames:
             continue
 
         record['local_dt'] = dt
+        position = record_position(record)
 
         try:
             ground_telemetry_collection.update_one(
                 filter={"local_dt": {"$eq": dt}},
                 update={
-                    "$setOnInsert": {key: val for key, val in record.items() if val not in {np.NaN, -1}},
+                    "$setOnInsert": {
+                        **{key: val for key, val in record.items() if val not in {np.NaN, -1}},
+                        **({'position': position} if position is not None else {}),
+                    },
                     "$set": {'source_id': log_filename_id},
                 },
                 upsert=True
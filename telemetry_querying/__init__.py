@@ -1,22 +1,21 @@
+from .field_names import telemetry_field_names, numeric_field_names
 from .interpolate_field import interpolate_field
-
-telemetry_field_names = [
-    "_id",
-    "utc_dt"
-    "E_lon", "N_lat", "H_m", "HDOP", "Nsat",
-    "I", "I_code",
-    "P0_hPa", "P1_hPa", "P0_code", "P1_code",
-    "T0_C", "T1_C", "T0_code", "T1_code",
-    "Ttop_C", "Tbot_C",
-    "Tp_C", "Tm_C",
-    "U15", "U5", "Uac",
-    "Clin1", "Clin2", "Clin_theta",
-    "Led_ch0", "Led_ch1", "Led_ch2", "Led_ch3",
-    "compass",
-    "from_datum",
-    "from_onboard",
-    "source_id",
-]
+from .field_range import field_range
+from .resampling import resample_field, resample_field_envelope
+from .rollups import field_overview
+from .flights import list_flights, query_flight
+from .columnar_store import ColumnarStore
 
 
-__all__ = ['interpolate_field', 'telemetry_field_names']
+__all__ = [
+    'interpolate_field',
+    'field_range',
+    'resample_field',
+    'resample_field_envelope',
+    'field_overview',
+    'list_flights',
+    'query_flight',
+    'ColumnarStore',
+    'telemetry_field_names',
+    'numeric_field_names',
+]
@@ -0,0 +1,160 @@
+"""Asyncio variants of telemetry_querying functions, built on motor driver
+
+All coroutines are meant to be used with collections from the shared client
+(see get_async_client), so that independent fetches issued together with
+asyncio.gather overlap their round trips to the server instead of queuing
+one after another:
+
+>>> from telemetry_querying.async_querying import (
+...     async_master_collection, interpolate_field_async, field_range_async
+... )
+>>> async def main():
+...     master = async_master_collection()
+...     H, P = await asyncio.gather(
+...         interpolate_field_async(master, 'H_m', dts),
+...         field_range_async(master, 'P0_hPa', start, end),
+...     )
+>>> asyncio.run(main())
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pandas as pd
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+
+from .buckets import (
+    BUCKET_NEIGHBOUR_LIMIT,
+    cached_layout,
+    remember_layout,
+    bucket_collection,
+    bucket_collection_filter,
+    bucket_range_filter,
+    bucket_docs_to_series,
+    bucket_neighbour_filter,
+    bucket_docs_neighbour_dt,
+)
+from .field_range import field_range_pipeline, docs_to_series
+from .interpolate_field import INTERPOLATION_KINDS, neighbour_pipeline, neighbour_dt, interpolate_series
+
+
+# assuming Mongo is running as mongod process/service and listening on localhost port 27017
+# for restoring data from dump see README.md
+MONGO_URI = "mongodb://localhost:27017"
+MAX_POOL_SIZE = 100  # upper bound on concurrently running queries
+
+
+# motor client is bound to event loop it was first used in, so one shared client per loop is kept
+_clients: Dict[asyncio.AbstractEventLoop, AsyncIOMotorClient] = {}
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    """Shared client (and connection pool) for the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        for closed_loop in [l for l in _clients if l.is_closed()]:
+            _clients.pop(closed_loop).close()
+        _clients[loop] = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MAX_POOL_SIZE, io_loop=loop)
+    return _clients[loop]
+
+
+def async_master_collection() -> AsyncIOMotorCollection:
+    return get_async_client().sphere_telemetry.master
+
+
+async def has_buckets_async(coll: AsyncIOMotorCollection) -> bool:
+    """Async version of has_buckets, sharing its per-collection cache"""
+    bucketed = cached_layout(coll)
+    if bucketed is None:
+        bucketed = bool(await coll.database.list_collection_names(filter=bucket_collection_filter(coll)))
+        remember_layout(coll, bucketed)
+    return bucketed
+
+
+async def field_range_async(coll: AsyncIOMotorCollection, field: str, start: datetime, end: datetime) -> pd.Series:
+    """Async version of field_range"""
+    if await has_buckets_async(coll):
+        docs = (
+            await bucket_collection(coll)
+            .find(bucket_range_filter(field, start, end), {field: True})
+            .sort("_id", 1)
+            .to_list(length=None)
+        )
+        return bucket_docs_to_series(docs, field, start, end)
+    docs = await coll.aggregate(field_range_pipeline(field, start, end)).to_list(length=None)
+    return docs_to_series(docs, field)
+
+
+async def fields_range_async(
+    coll: AsyncIOMotorCollection, fields: List[str], start: datetime, end: datetime
+) -> Dict[str, pd.Series]:
+    """Concurrently fetch several fields over the same time range, see field_range_async"""
+    series = await asyncio.gather(*[field_range_async(coll, field, start, end) for field in fields])
+    return dict(zip(fields, series))
+
+
+async def interpolate_field_async(
+    coll: AsyncIOMotorCollection, field: str, dts: List[datetime], kind: str = 'linear'
+) -> List[Any]:
+    """Async version of interpolate_field"""
+    if kind not in INTERPOLATION_KINDS:
+        raise ValueError(f"Invalid interpolation kind '{kind}'")
+
+    first_dt = min(dts)
+    last_dt = max(dts)
+    if await has_buckets_async(coll):
+        buckets = bucket_collection(coll)
+        field_doc, start_docs, end_docs = await asyncio.gather(
+            buckets.find_one(filter={field: {"$exists": True}}, projection={'_id': True}),
+            *[
+                buckets.find(bucket_neighbour_filter(field, dt, direction), {field: True})
+                .sort("_id", direction)
+                .to_list(length=BUCKET_NEIGHBOUR_LIMIT)
+                for dt, direction in ((first_dt, -1), (last_dt, 1))
+            ],
+        )
+        if field_doc is None:
+            raise ValueError(f"Invalid field '{field}'")
+        startdt = bucket_docs_neighbour_dt(start_docs, field, first_dt, -1)
+        enddt = bucket_docs_neighbour_dt(end_docs, field, last_dt, 1)
+        return interpolate_series(await field_range_async(coll, field, startdt, enddt), dts, kind)
+
+    # field validity and range bounds checks are independent and are run concurrently
+    field_doc, start_docs, end_docs = await asyncio.gather(
+        coll.find_one(filter={field: {"$exists": True}}, projection={'_id': True}),
+        coll.aggregate(neighbour_pipeline(field, first_dt, -1)).to_list(length=1),
+        coll.aggregate(neighbour_pipeline(field, last_dt, 1)).to_list(length=1),
+    )
+    if field_doc is None:
+        raise ValueError(f"Invalid field '{field}'")
+    startdt = neighbour_dt(start_docs, first_dt)
+    enddt = neighbour_dt(end_docs, last_dt)
+
+    return interpolate_series(await field_range_async(coll, field, startdt, enddt), dts, kind)
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    # smoke test against local mongod with restored dump: the same set of queries
+    # should take about as long as the slowest one when gathered
+    start = datetime.strptime("2013-03-13 08:00:00", r"%Y-%m-%d %X")
+    end = datetime.strptime("2013-03-13 10:00:00", r"%Y-%m-%d %X")
+    fields = ['H_m', 'P0_hPa', 'P1_hPa', 'T0_C', 'T1_C', 'compass']
+
+    async def sequential():
+        master = async_master_collection()
+        return [await field_range_async(master, field, start, end) for field in fields]
+
+    async def gathered():
+        return list((await fields_range_async(async_master_collection(), fields, start, end)).values())
+
+    async def main():
+        for coro in (sequential, gathered):
+            t0 = perf_counter()
+            res = await coro()
+            print(f"{coro.__name__}: {perf_counter() - t0:.3f} sec, {sum(len(s) for s in res)} values")
+        print(await interpolate_field_async(async_master_collection(), 'H_m', [start, end]))
+
+    asyncio.run(main())
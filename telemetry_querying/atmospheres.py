@@ -0,0 +1,181 @@
+"""Atmosphere profiles from onboard and ground pressure, per flight
+
+In 2011 and 2012 the detector was switched on already at altitude, so there are
+no ascent profiles. Instead, each flight profile is estimated from two sets of
+points: onboard pressure at flight height and ground pressure at ground station
+height, recorded at the nearest time. For all flights of a year at once:
+
+>>> from telemetry_querying.atmospheres import atmosphere_profiles
+>>> profiles, fits = atmosphere_profiles(db, 2012)
+
+Or write profiles to '2012_atmosphere_profiles.tsv' with
+
+    python -m telemetry_querying.atmospheres 2012
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from datetime import datetime
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from .flights import list_flights
+
+
+G = 9.81  # m / s^2
+M_AIR = 29 / 1000  # kg / mole
+R = 8.31  # J / (mole K)
+T_AIR = 270  # K, assumed constant
+
+
+def pressure_records(coll: Collection, start: datetime, end: datetime, query: dict = None) -> pd.DataFrame:
+    """Records with valid (positive) pressure P0_hPa and height H_m in (start, end)
+
+    Returns:
+        pd.DataFrame: utc_dt, p and h columns, sorted by utc_dt
+    """
+    docs = coll.find(
+        {
+            **(query or {}),
+            'utc_dt': {'$gt': start, '$lt': end},
+            'P0_hPa': {'$gt': 0},
+            'H_m': {'$exists': True},
+        },
+        {'_id': False, 'utc_dt': True, 'P0_hPa': True, 'H_m': True},
+    ).batch_size(10000)
+    df = pd.DataFrame(list(docs), columns=['utc_dt', 'P0_hPa', 'H_m'])
+    df = df.rename(columns={'P0_hPa': 'p', 'H_m': 'h'}).astype({'p': float, 'h': float})
+    df['utc_dt'] = pd.to_datetime(df['utc_dt'])
+    return df.sort_values('utc_dt', kind='mergesort', ignore_index=True)
+
+
+def label_flights(df: pd.DataFrame, flights: pd.DataFrame) -> pd.DataFrame:
+    """Add 'flight' column (number within year) to records, dropping records outside of flights
+
+    Args:
+        df (pd.DataFrame): records with sorted utc_dt column
+        flights (pd.DataFrame): flight index, see list_flights
+    """
+    flights = flights.sort_values('start_utc_dt')
+    starts = pd.to_datetime(flights['start_utc_dt']).to_numpy()
+    ends = pd.to_datetime(flights['end_utc_dt']).to_numpy()
+    dts = df['utc_dt'].to_numpy()
+    flight_idx = np.searchsorted(starts, dts, side='right') - 1
+    in_flight = (flight_idx >= 0) & (dts <= ends[np.maximum(flight_idx, 0)])
+    df = df[in_flight].copy()
+    df.insert(0, 'flight', flights['n_in_year'].to_numpy()[flight_idx[in_flight]])
+    return df
+
+
+def join_air_ground(air: pd.DataFrame, ground: pd.DataFrame) -> pd.DataFrame:
+    """Match each onboard record with the nearest in time ground record of the same flight
+
+    Args:
+        air, ground (pd.DataFrame): flight-labeled records, see label_flights
+
+    Returns:
+        pd.DataFrame: flight, utc_dt, p_air, h_air, p_ground, h_ground columns;
+            flights without ground records are dropped
+    """
+    joined = pd.merge_asof(
+        air.rename(columns={'p': 'p_air', 'h': 'h_air'}),
+        ground.rename(columns={'p': 'p_ground', 'h': 'h_ground'}),
+        on='utc_dt',
+        by='flight',
+        direction='nearest',
+    )
+    return joined.dropna().reset_index(drop=True)
+
+
+def flight_profiles(joined: pd.DataFrame) -> pd.DataFrame:
+    """Pressure-height points of all flights with overburden and density
+
+    Returns:
+        pd.DataFrame: source ('air' or 'ground'), flight, H_m, P_pa, T_g_cm_-2 and
+            rho_g_cm_-3 columns, onboard points followed by ground points for each flight
+    """
+    profiles = pd.concat(
+        [
+            pd.DataFrame({'flight': joined['flight'], 'H_m': joined['h_air'], 'P_pa': joined['p_air'] * 100}),
+            pd.DataFrame({'flight': joined['flight'], 'H_m': joined['h_ground'], 'P_pa': joined['p_ground'] * 100}),
+        ],
+        keys=['air', 'ground'],
+        names=['source', None],
+    ).reset_index(level='source')
+    profiles = profiles.sort_values(['flight', 'source'], kind='mergesort', ignore_index=True)
+    profiles['T_g_cm_-2'] = (profiles['P_pa'] / G) / 10  # kg / m^2 -> g / cm^2
+    profiles['rho_g_cm_-3'] = ((profiles['P_pa'] * M_AIR) / (R * T_AIR)) / 1000  # kg / m^3 -> g / cm^3
+    return profiles
+
+
+def fit_profiles(profiles: pd.DataFrame) -> pd.DataFrame:
+    """Fit barometric formula P = P0 * exp(-H / H_scale) to each flight profile
+
+    All flights are fitted at once with closed-form least squares for ln(P) vs H,
+    per-flight sums are accumulated with np.bincount.
+
+    Returns:
+        pd.DataFrame: P0_pa, H_scale_m, rms_ln_p and n_points indexed by flight;
+            NaN parameters for flights with all points at the same height
+    """
+    flights, flight_id = np.unique(profiles['flight'].to_numpy(), return_inverse=True)
+    h = profiles['H_m'].to_numpy(dtype=float)
+    ln_p = np.log(profiles['P_pa'].to_numpy(dtype=float))
+
+    def per_flight_sum(values):
+        return np.bincount(flight_id, weights=values, minlength=len(flights))
+
+    n = np.bincount(flight_id, minlength=len(flights))
+    h_mean = per_flight_sum(h) / n
+    ln_p_mean = per_flight_sum(ln_p) / n
+    dh = h - h_mean[flight_id]
+    dln_p = ln_p - ln_p_mean[flight_id]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = per_flight_sum(dh * dln_p) / per_flight_sum(dh ** 2)
+        residuals = dln_p - slope[flight_id] * dh
+        return pd.DataFrame(
+            {
+                'P0_pa': np.exp(ln_p_mean - slope * h_mean),
+                'H_scale_m': -1 / slope,
+                'rms_ln_p': np.sqrt(per_flight_sum(residuals ** 2) / n),
+                'n_points': n,
+            },
+            index=pd.Index(flights, name='flight'),
+        )
+
+
+def atmosphere_profiles(db: Database, year: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Profiles and barometric fits for all flights of the year
+
+    Onboard pressure is taken from datum records in master, ground pressure —
+    from from_ground_logs collection; flight bounds — from the flight index.
+
+    Returns:
+        profiles (pd.DataFrame): see flight_profiles
+        fits (pd.DataFrame): see fit_profiles
+    """
+    start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    flights = list_flights(db.master, year=year)
+    air = label_flights(pressure_records(db.master, start, end, {'from_datum': {'$exists': True}}), flights)
+    ground = label_flights(pressure_records(db.from_ground_logs, start, end), flights)
+    profiles = flight_profiles(join_air_ground(air, ground))
+    return profiles, fit_profiles(profiles)
+
+
+def write_profiles_tsv(profiles: pd.DataFrame, path: str):
+    profiles.to_csv(
+        path, sep='\t', index=False, columns=['flight', 'H_m', 'P_pa', 'T_g_cm_-2', 'rho_g_cm_-3'],
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    year = int(sys.argv[1]) if len(sys.argv) > 1 else 2012
+    client = MongoClient()
+    profiles, fits = atmosphere_profiles(client.sphere_telemetry, year)
+    print(fits)
+    write_profiles_tsv(profiles, f'{year}_atmosphere_profiles.tsv')
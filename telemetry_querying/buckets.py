@@ -0,0 +1,219 @@
+"""Time-bucketed columnar copy of the master collection
+
+master holds one sparse document per record, so reading one field over a flight
+touches tens of thousands of documents. Bucket collection (master_buckets) holds
+one document per fixed time window with per-field arrays of record times and values:
+
+    {
+        "_id" : ISODate("2013-03-13T08:00:00.000Z"),  // bucket start, epoch-aligned
+        "utc_dt" : ISODate("2013-03-13T08:00:00.000Z"),
+        "n_records" : 600,
+        "H_m" : {
+            "t" : [1000, 2000, ...],  // ms since bucket start, sorted
+            "v" : [450.1, 450.3, ...]
+        },
+        ...
+    }
+
+Fields absent from all records of the window are absent from the bucket document,
+so the usual {field: {$exists: true}} filters apply. field_range and interpolate_field
+(and their async versions) read buckets instead of master whenever the bucket collection
+exists; this is checked once per collection and process. Buckets are built by running
+this module:
+
+    python -m telemetry_querying.buckets
+
+and are updated for the time range of newly merged data with update_buckets.
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tqdm import tqdm
+
+from .field_names import telemetry_field_names
+from .rollups import floor_dt, ceil_dt, _bucket_start
+
+
+BUCKET_SEC = 600
+
+# buckets are (re)computed chunk by chunk to bound aggregation memory on the server
+BUCKETS_CHUNK = timedelta(days=1)
+
+bucketed_field_names = [field for field in telemetry_field_names if field not in {"_id", "utc_dt"}]
+
+
+def bucket_collection(master: Collection) -> Collection:
+    return master.database[f"{master.name}_buckets"]
+
+
+# (client, collection) -> whether its bucketed copy exists; layout is resolved once per process,
+# call reset_layout_cache after dropping bucket collection
+_layouts: Dict[Tuple[int, str], bool] = dict()
+
+
+def _layout_key(coll) -> Tuple[int, str]:
+    return id(coll.database.client), coll.full_name
+
+
+def cached_layout(coll) -> Optional[bool]:
+    """Whether bucketed copy of the collection (pymongo or motor) exists, None if not resolved yet"""
+    return _layouts.get(_layout_key(coll))
+
+
+def remember_layout(coll, bucketed: bool):
+    _layouts[_layout_key(coll)] = bucketed
+
+
+def reset_layout_cache():
+    _layouts.clear()
+
+
+def bucket_collection_filter(coll) -> dict:
+    """list_collection_names filter for bucketed copy of the collection"""
+    return {'name': bucket_collection(coll).name}
+
+
+def has_buckets(coll: Collection) -> bool:
+    """Whether bucketed copy of the collection exists"""
+    bucketed = cached_layout(coll)
+    if bucketed is None:
+        bucketed = bool(coll.database.list_collection_names(filter=bucket_collection_filter(coll)))
+        remember_layout(coll, bucketed)
+    return bucketed
+
+
+def buckets_from_master_pipeline(
+    target: Collection, start: datetime, end: datetime, fields: List[str] = bucketed_field_names
+) -> List[dict]:
+    bucket_start_ms = {"$toLong": "$_id"}
+    group = {"_id": _bucket_start(BUCKET_SEC), "n_records": {"$sum": 1}}
+    for field in fields:
+        # missing values ($$REMOVE) are not pushed
+        group[field] = {"$push": {"$cond": [
+            {"$gt": [f"${field}", None]},
+            {"t": {"$toLong": "$utc_dt"}, "v": f"${field}"},
+            "$$REMOVE",
+        ]}}
+    projection = {"utc_dt": "$_id", "n_records": True}
+    for field in fields:
+        projection[field] = {"$cond": [
+            {"$gt": [{"$size": f"${field}"}, 0]},
+            {
+                "t": {"$map": {"input": f"${field}.t", "in": {"$subtract": ["$$this", bucket_start_ms]}}},
+                "v": f"${field}.v",
+            },
+            "$$REMOVE",
+        ]}
+    return [
+        {"$match": {"utc_dt": {"$gte": start, "$lt": end}}},
+        # $push keeps the order in which documents enter $group
+        {"$sort": {"utc_dt": 1}},
+        {"$group": group},
+        {"$project": projection},
+        {"$merge": {"into": target.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def update_buckets(master: Collection, start: datetime, end: datetime, progress: bool = False):
+    """Rebuild all buckets overlapping [start, end], e.g. after new data is merged to master"""
+    start = floor_dt(start, BUCKET_SEC)
+    end = ceil_dt(end + timedelta(microseconds=1), BUCKET_SEC)
+    target = bucket_collection(master)
+
+    chunk_starts = []
+    while start + len(chunk_starts) * BUCKETS_CHUNK < end:
+        chunk_starts.append(start + len(chunk_starts) * BUCKETS_CHUNK)
+    for chunk_start in tqdm(chunk_starts, disable=not progress):
+        chunk_end = min(chunk_start + BUCKETS_CHUNK, end)
+        master.aggregate(buckets_from_master_pipeline(target, chunk_start, chunk_end), allowDiskUse=True)
+    remember_layout(master, True)
+
+
+def build_buckets(master: Collection, progress: bool = True):
+    """Bucket the whole master collection"""
+    first_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", 1)])
+    last_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", -1)])
+    if first_doc is None:
+        return
+    update_buckets(master, first_doc['utc_dt'], last_doc['utc_dt'], progress=progress)
+
+
+def _unpack(doc: dict, field: str) -> Tuple[np.ndarray, list]:
+    """Record times (datetime64[ms]) and values of 'field' from bucket document"""
+    t = np.datetime64(doc['_id'], 'ms') + np.asarray(doc[field]['t'], dtype='timedelta64[ms]')
+    return t, doc[field]['v']
+
+
+def bucket_range_filter(field: str, start: datetime, end: datetime) -> dict:
+    """Filter selecting buckets with 'field' records in [start, end], to be sorted by _id"""
+    return {"_id": {"$gte": floor_dt(start, BUCKET_SEC), "$lte": end}, field: {"$exists": True}}
+
+
+def bucket_docs_to_series(docs: Iterable[dict], field: str, start: datetime, end: datetime) -> pd.Series:
+    """Unpack bucket documents selected with bucket_range_filter into time-indexed Series, see field_range"""
+    dts = []
+    values = []
+    for doc in docs:
+        t, v = _unpack(doc, field)
+        dts.append(t)
+        values.extend(v)
+    dts = np.concatenate(dts) if dts else np.array([], dtype='datetime64[ms]')
+    in_range = (dts >= np.datetime64(start, 'ms')) & (dts <= np.datetime64(end, 'ms'))
+    series = pd.Series(
+        data=values,
+        index=pd.DatetimeIndex(dts.astype('datetime64[ns]'), name='utc_dt'),
+        name=field,
+        dtype=None if values else float,
+    )
+    return series[in_range]
+
+
+def bucket_neighbour_filter(field: str, dt: datetime, direction: int) -> dict:
+    """Filter selecting buckets with 'field' records before 'dt' (direction=-1) or after it (direction=1),
+    to be sorted by _id in the same direction; the neighbour is always in the first BUCKET_NEIGHBOUR_LIMIT of them
+    """
+    dt_filter = {"$lte": dt} if direction == -1 else {"$gte": floor_dt(dt, BUCKET_SEC)}
+    return {"_id": dt_filter, field: {"$exists": True}}
+
+
+# only the bucket containing dt may have records on the wrong side of it only,
+# any next one has records with the field on the right side
+BUCKET_NEIGHBOUR_LIMIT = 2
+
+
+def bucket_docs_neighbour_dt(docs: Iterable[dict], field: str, dt: datetime, direction: int) -> datetime:
+    """Time of the closest to 'dt' record with 'field' in buckets selected with bucket_neighbour_filter"""
+    dt_ms = np.datetime64(dt, 'ms')
+    for doc in docs:
+        t, _ = _unpack(doc, field)
+        t = t[t <= dt_ms] if direction == -1 else t[t >= dt_ms]
+        if len(t):
+            return pd.Timestamp(t.max() if direction == -1 else t.min()).to_pydatetime()
+    raise IndexError(f"Requested dt={dt} seems to be out of bounds!")
+
+
+def bucket_field_range(buckets: Collection, field: str, start: datetime, end: datetime) -> pd.Series:
+    """Same as field_range, read from bucket collection"""
+    docs = buckets.find(bucket_range_filter(field, start, end), {field: True}).sort("_id", 1)
+    return bucket_docs_to_series(docs, field, start, end)
+
+
+def bucket_neighbour_dt(buckets: Collection, field: str, dt: datetime, direction: int) -> datetime:
+    """Time of the closest to 'dt' record with 'field', before it (direction=-1) or after it (direction=1)"""
+    docs = (
+        buckets.find(bucket_neighbour_filter(field, dt, direction), {field: True})
+        .sort("_id", direction)
+        .limit(BUCKET_NEIGHBOUR_LIMIT)
+    )
+    return bucket_docs_neighbour_dt(docs, field, dt, direction)
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    build_buckets(client.sphere_telemetry.master)
@@ -0,0 +1,187 @@
+"""Offline columnar copy of the master collection and Mongo-free query engine for it
+
+Store layout — one directory per year, one NumPy file per field:
+
+    store_dir/
+        2013/
+            utc_dt.npy        // int64, ns since epoch, sorted
+            H_m.npy           // float64, NaN where record has no such field
+            H_m.valid.npy     // bool, True where record has the field
+            ...
+
+Files are read memory-mapped, so queries only touch the pages they need.
+Export master to the store with
+
+    python -m telemetry_querying.columnar_store path/to/store_dir
+
+and query it with ColumnarStore, providing the same API as functions working
+with the database:
+
+>>> from telemetry_querying import ColumnarStore
+>>> store = ColumnarStore('path/to/store_dir')
+>>> H = store.interpolate_field('H_m', dts)
+>>> P = store.field_range('P0_hPa', start_dt, end_dt)
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from tqdm import tqdm
+
+from .field_names import numeric_field_names
+from .interpolate_field import INTERPOLATION_KINDS, interpolate_series
+
+
+EXPORT_BATCH_SIZE = 100000  # records buffered in memory before writing to the store
+
+
+def _to_ns(dt: datetime) -> int:
+    return int(np.datetime64(dt, 'ns').astype(np.int64))
+
+
+def export_columnar_store(
+    master: Collection, store_dir: Union[str, Path], fields: List[str] = numeric_field_names, progress: bool = True
+):
+    """Write master collection to columnar store, one partition per year"""
+    store_dir = Path(store_dir)
+    first_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", 1)])
+    last_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", -1)])
+    if first_doc is None:
+        return
+
+    for year in range(first_doc['utc_dt'].year, last_doc['utc_dt'].year + 1):
+        query = {"utc_dt": {"$gte": datetime(year, 1, 1), "$lt": datetime(year + 1, 1, 1)}}
+        n_records = master.count_documents(query)
+        if n_records == 0:
+            continue
+        year_dir = store_dir / str(year)
+        year_dir.mkdir(parents=True, exist_ok=True)
+
+        utc_dt = open_memmap(year_dir / 'utc_dt.npy', mode='w+', dtype=np.int64, shape=(n_records,))
+        values = {
+            field: open_memmap(year_dir / f'{field}.npy', mode='w+', dtype=np.float64, shape=(n_records,))
+            for field in fields
+        }
+        valid = {
+            field: open_memmap(year_dir / f'{field}.valid.npy', mode='w+', dtype=np.bool_, shape=(n_records,))
+            for field in fields
+        }
+
+        def write_batch(batch_start: int, batch: List[dict]):
+            batch_end = batch_start + len(batch)
+            utc_dt[batch_start:batch_end] = [_to_ns(doc['utc_dt']) for doc in batch]
+            for field in fields:
+                column = np.array([doc.get(field, np.nan) for doc in batch], dtype=np.float64)
+                values[field][batch_start:batch_end] = column
+                valid[field][batch_start:batch_end] = ~np.isnan(column)
+
+        cursor = master.find(query, {"_id": False, "utc_dt": True, **{field: True for field in fields}})
+        batch = []
+        batch_start = 0
+        for doc in tqdm(cursor.sort("utc_dt", 1).batch_size(10000), total=n_records, disable=not progress):
+            batch.append(doc)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                write_batch(batch_start, batch)
+                batch_start += len(batch)
+                batch = []
+        write_batch(batch_start, batch)
+
+        for field in fields:
+            has_values = valid[field].any()
+            del values[field], valid[field]  # flush and close memmaps
+            if not has_values:
+                (year_dir / f'{field}.npy').unlink()
+                (year_dir / f'{field}.valid.npy').unlink()
+        utc_dt.flush()
+
+
+class ColumnarStore:
+    """Query engine for columnar store created by export_columnar_store"""
+
+    def __init__(self, store_dir: Union[str, Path]):
+        self.store_dir = Path(store_dir)
+        self.years = sorted(int(p.name) for p in self.store_dir.iterdir() if p.is_dir() and p.name.isdigit())
+        if not self.years:
+            raise ValueError(f"No columnar store partitions found in '{self.store_dir}'")
+        self._columns: Dict[tuple, np.ndarray] = dict()
+
+    def _column(self, year: int, name: str) -> np.ndarray:
+        key = (year, name)
+        if key not in self._columns:
+            self._columns[key] = np.load(self.store_dir / str(year) / f'{name}.npy', mmap_mode='r')
+        return self._columns[key]
+
+    def _has_field(self, year: int, field: str) -> bool:
+        return (self.store_dir / str(year) / f'{field}.npy').exists()
+
+    def _years_between(self, start: datetime, end: datetime) -> List[int]:
+        return [year for year in self.years if start.year <= year <= end.year]
+
+    def _field_slice(self, year: int, field: str, start_ns: int, end_ns: int):
+        t = self._column(year, 'utc_dt')
+        i_start = np.searchsorted(t, start_ns, side='left')
+        i_end = np.searchsorted(t, end_ns, side='right')
+        mask = self._column(year, f'{field}.valid')[i_start:i_end]
+        return t[i_start:i_end][mask], self._column(year, field)[i_start:i_end][mask]
+
+    def field_range(self, field: str, start: datetime, end: datetime) -> pd.Series:
+        """Get all values of 'field' recorded between 'start' and 'end' (inclusive) as time-indexed Series"""
+        t_parts = [np.array([], dtype=np.int64)]
+        value_parts = [np.array([], dtype=np.float64)]
+        for year in self._years_between(start, end):
+            if self._has_field(year, field):
+                t_part, value_part = self._field_slice(year, field, _to_ns(start), _to_ns(end))
+                t_parts.append(t_part)
+                value_parts.append(value_part)
+        return pd.Series(
+            data=np.concatenate(value_parts),
+            index=pd.DatetimeIndex(np.concatenate(t_parts).astype('datetime64[ns]'), name='utc_dt'),
+            name=field,
+        )
+
+    def neighbour_dt(self, field: str, dt: datetime, direction: int) -> datetime:
+        """The closest to 'dt' time of record with 'field', before it (direction=-1) or after it (direction=1)"""
+        dt_ns = _to_ns(dt)
+        years = [y for y in self.years if (y <= dt.year if direction == -1 else y >= dt.year)]
+        for year in (reversed(years) if direction == -1 else years):
+            if not self._has_field(year, field):
+                continue
+            t = self._column(year, 'utc_dt')
+            valid = self._column(year, f'{field}.valid')
+            if direction == -1:
+                candidates = np.nonzero(valid[:np.searchsorted(t, dt_ns, side='right')])[0]
+                idx = candidates[-1] if len(candidates) else None
+            else:
+                i_start = np.searchsorted(t, dt_ns, side='left')
+                candidates = np.nonzero(valid[i_start:])[0]
+                idx = i_start + candidates[0] if len(candidates) else None
+            if idx is not None:
+                return pd.Timestamp(int(t[idx])).to_pydatetime()
+        raise IndexError(f"Requested dt={dt} seems to be out of bounds!")
+
+    def interpolate_field(self, field: str, dts: List[datetime], kind: str = 'linear') -> List[Any]:
+        """Get interpolated values of 'field' at arbitrary datetimes 'dts', see interpolate_field"""
+        if kind not in INTERPOLATION_KINDS:
+            raise ValueError(f"Invalid interpolation kind '{kind}'")
+        if not any(self._has_field(year, field) for year in self.years):
+            raise ValueError(f"Invalid field '{field}'")
+        startdt = self.neighbour_dt(field, min(dts), -1)
+        enddt = self.neighbour_dt(field, max(dts), 1)
+        return interpolate_series(self.field_range(field, startdt, enddt), dts, kind)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("usage: python -m telemetry_querying.columnar_store path/to/store_dir")
+        sys.exit(1)
+    client = MongoClient()
+    export_columnar_store(client.sphere_telemetry.master, sys.argv[1])
@@ -0,0 +1,205 @@
+"""Streaming export of telemetry records to CSV or Parquet
+
+Records are read from the cursor in batches of EXPORT_BATCH_SIZE documents and each
+batch is written to the file as soon as it is complete, so memory use does not depend
+on the exported time range:
+
+>>> from telemetry_querying.export import export_records
+>>> export_records(master, 'season_2013.csv', start_dt, end_dt)  # all fields
+>>> export_records(master, 'H_1min.parquet', start_dt, end_dt, fields=['H_m'], step=60)
+
+or from command line:
+
+    python -m telemetry_querying.export season_2013.csv --start 2013-01-01 --end 2014-01-01
+    python -m telemetry_querying.export H_1min.parquet --start 2013-03-13 --end 2013-03-14 --fields H_m --step 60
+
+Parquet export requires pyarrow, which is not installed with the rest of requirements.
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from tqdm import tqdm
+
+from .field_names import telemetry_field_names, numeric_field_names
+from .resampling import step_to_ms
+
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_BATCH_SIZE = 50000  # documents per cursor batch and per written chunk
+
+exported_field_names = [field for field in telemetry_field_names if field not in {"_id", "utc_dt"}]
+
+
+def export_pipeline(
+    start: datetime,
+    end: datetime,
+    fields: List[str],
+    query: Optional[dict] = None,
+    step: Union[float, timedelta, None] = None,
+) -> List[dict]:
+    """Aggregation pipeline selecting records with any of 'fields' in start <= utc_dt < end, sorted by time
+
+    With 'step', records are bucketed on uniform grid instead (see resample_pipeline)
+    and each output document has bucket number as _id and mean of each field in the bucket.
+    """
+    match = {
+        **(query or {}),
+        "utc_dt": {"$gte": start, "$lt": end},
+        "$or": [{field: {"$exists": True}} for field in fields],
+    }
+    if step is None:
+        return [
+            {"$match": match},
+            {"$sort": {"utc_dt": 1}},
+            {"$project": {"_id": False, "utc_dt": True, **{field: True for field in fields}}},
+        ]
+    group = {"_id": {"$floor": {"$divide": [{"$subtract": ["$utc_dt", start]}, step_to_ms(step)]}}}
+    for field in fields:
+        group[field] = {"$avg": f"${field}"}
+    return [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def record_chunks(
+    coll: Collection,
+    start: datetime,
+    end: datetime,
+    fields: List[str],
+    query: Optional[dict] = None,
+    step: Union[float, timedelta, None] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """Stream exported records as DataFrames with utc_dt and 'fields' columns, NaN where field is absent"""
+    columns = ['utc_dt', *fields]
+    docs = coll.aggregate(export_pipeline(start, end, fields, query, step), allowDiskUse=True, batchSize=batch_size)
+
+    def to_frame(batch: List[dict]) -> pd.DataFrame:
+        if step is not None:
+            step_ms = step_to_ms(step)
+            for doc in batch:
+                doc['utc_dt'] = start + timedelta(milliseconds=int(doc.pop('_id')) * step_ms)
+        return pd.DataFrame(batch, columns=columns)
+
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield to_frame(batch)
+            batch = []
+    if batch:
+        yield to_frame(batch)
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], path: Path, columns: List[str]) -> int:
+    n_rows = 0
+    with open(path, 'w', newline='') as f:
+        pd.DataFrame(columns=columns).to_csv(f, index=False)
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=False)
+            n_rows += len(chunk)
+    return n_rows
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], path: Path, columns: List[str]) -> int:
+    """Write chunks to Parquet file as row groups; all fields are stored as float64, NaN where absent"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow, install it with 'pip install pyarrow' or export to CSV") from e
+
+    # fixed schema, otherwise chunks where a field is absent would get different column types
+    schema = pa.schema([('utc_dt', pa.timestamp('ms'))] + [(field, pa.float64()) for field in columns[1:]])
+    n_rows = 0
+    with pq.ParquetWriter(str(path), schema) as writer:
+        for chunk in chunks:
+            for field in columns[1:]:
+                chunk[field] = pd.to_numeric(chunk[field], errors='coerce').astype(np.float64)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            n_rows += len(chunk)
+    return n_rows
+
+
+def export_records(
+    coll: Collection,
+    path: Union[str, Path],
+    start: datetime,
+    end: datetime,
+    fields: Optional[List[str]] = None,
+    query: Optional[dict] = None,
+    step: Union[float, timedelta, None] = None,
+    format_: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    progress: bool = False,
+) -> int:
+    """Export records between 'start' (inclusive) and 'end' (exclusive) to file, batch by batch
+
+    Args:
+        coll (Collection): telemetry collection, normally master
+        path (str | Path): output file
+        start, end (datetime): time range
+        fields (list of str | None): exported fields (columns), all by default; records without
+            any of them are skipped
+        query (dict | None): additional filter on records
+        step (float | timedelta | None): if given, fields are averaged on uniform grid with this step,
+            in seconds if number; empty buckets are skipped
+        format_ (str | None): 'csv' or 'parquet', by default guessed from path suffix
+        batch_size (int): documents read and written at once
+
+    Returns:
+        int: number of written rows
+    """
+    path = Path(path)
+    format_ = format_ or path.suffix.lstrip('.').lower()
+    if format_ not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format '{format_}'")
+    if fields is None:
+        fields = numeric_field_names if step is not None else exported_field_names
+    invalid_fields = [field for field in fields if field not in telemetry_field_names]
+    if invalid_fields:
+        raise ValueError(f"Invalid fields {invalid_fields}")
+
+    chunks = record_chunks(coll, start, end, fields, query, step, batch_size)
+    if progress:
+        chunks = tqdm(chunks, unit='batch')
+    write = write_csv if format_ == 'csv' else write_parquet
+    return write(chunks, path, ['utc_dt', *fields])
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Export records from master collection to CSV or Parquet")
+    parser.add_argument("path", help="output file, .csv or .parquet")
+    parser.add_argument("--start", type=datetime.fromisoformat, required=True, help="UTC, e.g. 2013-03-13T08:00")
+    parser.add_argument("--end", type=datetime.fromisoformat, required=True, help="UTC, not included")
+    parser.add_argument("--fields", nargs="+", help="exported fields, all by default")
+    parser.add_argument("--step", type=float, help="average fields on uniform grid with this step, sec")
+    parser.add_argument("--query", type=json.loads, help="additional filter as JSON, e.g. '{\"from_datum\": true}'")
+    parser.add_argument("--format", dest="format_", choices=EXPORT_FORMATS, help="by default guessed from path")
+    args = parser.parse_args()
+
+    client = MongoClient()
+    n_rows = export_records(
+        client.sphere_telemetry.master,
+        args.path,
+        args.start,
+        args.end,
+        fields=args.fields,
+        query=args.query,
+        step=args.step,
+        format_=args.format_,
+        progress=True,
+    )
+    print(f"{n_rows} rows written to {args.path}")
@@ -0,0 +1,23 @@
+telemetry_field_names = [
+    "_id",
+    "utc_dt",
+    "E_lon", "N_lat", "H_m", "HDOP", "Nsat",
+    "I", "I_code",
+    "P0_hPa", "P1_hPa", "P0_code", "P1_code",
+    "T0_C", "T1_C", "T0_code", "T1_code",
+    "Ttop_C", "Tbot_C",
+    "Tp_C", "Tm_C",
+    "U15", "U5", "Uac",
+    "Clin1", "Clin2", "Clin_theta",
+    "Led_ch0", "Led_ch1", "Led_ch2", "Led_ch3",
+    "compass",
+    "from_datum",
+    "from_onboard",
+    "source_id",
+]
+
+# fields with measured values, as opposed to ids, timestamps and source flags
+numeric_field_names = [
+    field for field in telemetry_field_names
+    if field not in {"_id", "utc_dt", "from_datum", "from_onboard", "source_id"}
+]
@@ -0,0 +1,53 @@
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime
+from typing import Iterable, List
+
+import pandas as pd
+
+from .buckets import has_buckets, bucket_collection, bucket_field_range
+
+
+def field_range_pipeline(field: str, start: datetime, end: datetime) -> List[dict]:
+    """Aggregation pipeline selecting (utc_dt, 'field') pairs for start <= utc_dt <= end, sorted by time"""
+    return [
+        {"$match": {"utc_dt": {"$gte": start, "$lte": end}, field: {"$exists": True}}},
+        {"$sort": {"utc_dt": 1}},
+        {"$project": {"_id": False, "utc_dt": True, field: True}},
+    ]
+
+
+def docs_to_series(docs: Iterable[dict], field: str) -> pd.Series:
+    """Pack documents with 'utc_dt' and 'field' keys into time-indexed Series"""
+    dts = []
+    values = []
+    for doc in docs:
+        dts.append(doc['utc_dt'])
+        values.append(doc[field])
+    return pd.Series(
+        data=values,
+        index=pd.DatetimeIndex(dts, name='utc_dt'),
+        name=field,
+        dtype=None if values else float,
+    )
+
+
+def field_range(coll: Collection, field: str, start: datetime, end: datetime) -> pd.Series:
+    """Get all values of 'field' recorded between 'start' and 'end' (inclusive) as time-indexed Series
+
+    Bucketed copy of the collection is read instead of it if exists, see telemetry_querying.buckets
+    """
+    if has_buckets(coll):
+        return bucket_field_range(bucket_collection(coll), field, start, end)
+    return docs_to_series(coll.aggregate(field_range_pipeline(field, start, end)), field)
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    test = client.sphere_telemetry.master
+    print(field_range(
+        test,
+        'H_m',
+        datetime.strptime("2013-03-13 08:00:01", r"%Y-%m-%d %X"),
+        datetime.strptime("2013-03-13 08:01:01", r"%Y-%m-%d %X"),
+    ))
@@ -0,0 +1,155 @@
+"""Flight index: persisted flight boundaries and per-flight metadata
+
+Flights are detected once by splitting master records where time gap between
+subsequent records exceeds FLIGHT_GAP_SEC and stored in master_flights collection,
+one document per flight:
+
+    {
+        "_id" : 7,  // global flight number
+        "year" : 2013, "n_in_year" : 2,  // 1-based flight number within year
+        "start_utc_dt" : ISODate("2013-03-13T07:56:00.000Z"),
+        "end_utc_dt" : ISODate("2013-03-13T13:02:41.000Z"),
+        "n_records" : 18234,
+        "from_datum" : 17001, "from_onboard" : 1233,  // number of records from each source
+        "source_ids" : [3, 4],
+        "coverage" : {"H_m" : 18101, "P0_hPa" : 17990, ...}  // number of records with each field
+    }
+
+Build or rebuild the index with
+
+    python -m telemetry_querying.flights
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .field_names import numeric_field_names
+
+
+FLIGHT_GAP_SEC = 24000  # longer breaks in records separate flights
+
+
+def flight_index_collection(master: Collection) -> Collection:
+    return master.database[f"{master.name}_flights"]
+
+
+def split_flights(dts: np.ndarray, gap_sec: float = FLIGHT_GAP_SEC) -> Tuple[np.ndarray, np.ndarray]:
+    """Split sorted timestamps into flights
+
+    Returns:
+        start_idx, end_idx (np.ndarray): indices of the first and the last timestamp in each flight
+    """
+    if len(dts) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    dts_sec = np.asarray(dts, dtype='datetime64[ns]').astype(np.int64) / 10 ** 9
+    breaks = np.nonzero(np.diff(dts_sec) > gap_sec)[0]
+    start_idx = np.concatenate(([0], breaks + 1))
+    end_idx = np.concatenate((breaks, [len(dts_sec) - 1]))
+    return start_idx, end_idx
+
+
+def build_flight_index(master: Collection, gap_sec: float = FLIGHT_GAP_SEC) -> List[dict]:
+    """Detect flights in master and (re)write flight index collection
+
+    Requires one pass over master timestamps and one $bucket aggregation for per-flight stats
+    """
+    dts = [
+        doc['utc_dt']
+        for doc in master.find({"utc_dt": {"$exists": True}}, {"_id": False, "utc_dt": True}).sort("utc_dt", 1)
+    ]
+    start_idx, end_idx = split_flights(np.array(dts, dtype='datetime64[ns]'), gap_sec)
+    if len(start_idx) == 0:
+        return []
+
+    starts = [dts[i] for i in start_idx]
+    ends = [dts[i] for i in end_idx]
+    stats_output = {
+        "n_records": {"$sum": 1},
+        "from_datum": {"$sum": {"$cond": [{"$eq": ["$from_datum", True]}, 1, 0]}},
+        "from_onboard": {"$sum": {"$cond": [{"$eq": ["$from_onboard", True]}, 1, 0]}},
+        "source_ids": {"$addToSet": "$source_id"},
+    }
+    for field in numeric_field_names:
+        stats_output[field] = {"$sum": {"$cond": [{"$gt": [f"${field}", None]}, 1, 0]}}
+    stats = {
+        doc['_id']: doc
+        for doc in master.aggregate([
+            {"$match": {"utc_dt": {"$gte": starts[0], "$lte": ends[-1]}}},
+            {"$bucket": {
+                "groupBy": "$utc_dt",
+                # last boundary is exclusive, hence the shift
+                "boundaries": [*starts, ends[-1] + timedelta(milliseconds=1)],
+                "output": stats_output,
+            }},
+        ], allowDiskUse=True)
+    }
+
+    flights = []
+    n_in_year = dict()
+    for flight_n, (start, end) in enumerate(zip(starts, ends)):
+        n_in_year[start.year] = n_in_year.get(start.year, 0) + 1
+        flight_stats = stats[start]
+        flights.append({
+            "_id": flight_n,
+            "year": start.year,
+            "n_in_year": n_in_year[start.year],
+            "start_utc_dt": start,
+            "end_utc_dt": end,
+            "n_records": flight_stats['n_records'],
+            "from_datum": flight_stats['from_datum'],
+            "from_onboard": flight_stats['from_onboard'],
+            "source_ids": sorted(flight_stats['source_ids']),
+            "coverage": {field: flight_stats[field] for field in numeric_field_names if flight_stats[field] > 0},
+        })
+
+    index = flight_index_collection(master)
+    index.delete_many({})
+    index.insert_many(flights)
+    return flights
+
+
+def list_flights(master: Collection, year: Optional[int] = None) -> pd.DataFrame:
+    """Flight index as DataFrame, optionally for one year only"""
+    query = {} if year is None else {"year": year}
+    flights = list(flight_index_collection(master).find(query, {"coverage": False}).sort("_id", 1))
+    if not flights:
+        raise ValueError("Flight index is empty, see telemetry_querying.flights.build_flight_index")
+    return pd.DataFrame(flights).set_index('_id').rename_axis('flight')
+
+
+def get_flight(master: Collection, n: int, year: Optional[int] = None) -> dict:
+    """Flight index document by global flight number 'n', or by 1-based number within 'year'"""
+    query = {"_id": n} if year is None else {"year": year, "n_in_year": n}
+    flight = flight_index_collection(master).find_one(query)
+    if flight is None:
+        raise ValueError(f"No flight {n}" + (f" in {year}" if year is not None else "") + " in flight index")
+    return flight
+
+
+def query_flight(master: Collection, n: int, fields: List[str], year: Optional[int] = None) -> pd.DataFrame:
+    """Get all records with any of 'fields' in flight (see get_flight for numbering)
+
+    Returns:
+        pd.DataFrame: 'fields' columns indexed with utc_dt, NaN where field is absent
+    """
+    flight = get_flight(master, n, year)
+    docs = master.find(
+        {
+            "utc_dt": {"$gte": flight['start_utc_dt'], "$lte": flight['end_utc_dt']},
+            "$or": [{field: {"$exists": True}} for field in fields],
+        },
+        {"_id": False, "utc_dt": True, **{field: True for field in fields}},
+    ).sort("utc_dt", 1)
+    df = pd.DataFrame(list(docs), columns=['utc_dt', *fields])
+    return df.set_index('utc_dt')
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    build_flight_index(client.sphere_telemetry.master)
+    print(list_flights(client.sphere_telemetry.master))
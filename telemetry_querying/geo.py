@@ -0,0 +1,170 @@
+"""Balloon positions as GeoJSON points and spatial queries over them
+
+N_lat and E_lon are stored as parsed from NMEA, in ddmm.mmmm form. Every record
+with valid both of them gets 'position' field in decimal degrees:
+
+    "position" : {"type" : "Point", "coordinates" : [104.38893, 51.79678]}  // [lon, lat]
+
+indexed with 2dsphere index (see telemetry_querying.indexes). Positions are derived
+by ETL and merge steps, for already loaded records run
+
+    python -m telemetry_querying.geo
+
+Records within 5 km from a point or in a bounding box over a time range:
+
+>>> from telemetry_querying.geo import records_near, records_in_box
+>>> df = records_near(master, 51.8, 104.4, 5, fields=['H_m'])
+>>> df = records_in_box(master, 51.7, 51.9, 104.2, 104.6, start=start_dt, end=end_dt)
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS_KM = 6378.1
+
+BOX_EDGE_POINTS = 32  # box edges are densified so that geodesic edges follow parallels
+
+
+def ddmm_to_degrees(ddmm) -> np.ndarray:
+    """Decimal degrees from NMEA ddmm.mmmm values, NaN for missing and malformed ones"""
+    ddmm = np.asarray(ddmm, dtype=float)
+    degrees = np.trunc(ddmm / 100)
+    minutes = ddmm - degrees * 100
+    return np.where((ddmm > 0) & (minutes < 60), degrees + minutes / 60, np.nan)
+
+
+def geojson_points(N_lat, E_lon) -> np.ndarray:
+    """GeoJSON points from ddmm.mmmm latitudes and longitudes, None where position is invalid"""
+    lat = ddmm_to_degrees(N_lat)
+    lon = ddmm_to_degrees(E_lon)
+    valid = (lat <= 90) & (lon <= 180)  # comparisons with NaN are False
+    points = np.full(len(lat), None, dtype=object)
+    points[valid] = [
+        {'type': 'Point', 'coordinates': [float(lon_), float(lat_)]} for lat_, lon_ in zip(lat[valid], lon[valid])
+    ]
+    return points
+
+
+def record_position(record: dict) -> Optional[dict]:
+    """GeoJSON point for a single record with N_lat and E_lon, None if it has no valid position"""
+    return geojson_points([record.get('N_lat', np.nan)], [record.get('E_lon', np.nan)])[0]
+
+
+def _degrees_expr(field: str) -> dict:
+    degrees = {"$trunc": {"$divide": [f"${field}", 100]}}
+    minutes = {"$subtract": [f"${field}", {"$multiply": [degrees, 100]}]}
+    return {"$add": [degrees, {"$divide": [minutes, 60]}]}
+
+
+def position_expr() -> dict:
+    """Aggregation expression evaluating to record's GeoJSON point, same as record_position,
+    or removing the field if position is invalid"""
+    valid = {"$and": [
+        {"$gt": ["$N_lat", 0]},
+        {"$gt": ["$E_lon", 0]},
+        {"$lt": [{"$mod": ["$N_lat", 100]}, 60]},
+        {"$lt": [{"$mod": ["$E_lon", 100]}, 60]},
+        {"$lte": [_degrees_expr('N_lat'), 90]},
+        {"$lte": [_degrees_expr('E_lon'), 180]},
+    ]}
+    return {"$cond": [
+        valid,
+        {"type": "Point", "coordinates": [_degrees_expr('E_lon'), _degrees_expr('N_lat')]},
+        "$$REMOVE",
+    ]}
+
+
+def backfill_positions(coll: Collection):
+    """(Re)compute position of all records in collection on the server side"""
+    coll.update_many(
+        {"N_lat": {"$exists": True}, "E_lon": {"$exists": True}},
+        [{"$set": {"position": position_expr()}}],
+    )
+
+
+def near_filter(lat: float, lon: float, radius_km: float) -> dict:
+    return {"position": {"$geoWithin": {"$centerSphere": [[lon, lat], radius_km / EARTH_RADIUS_KM]}}}
+
+
+def box_filter(lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> dict:
+    lons = np.linspace(lon_min, lon_max, BOX_EDGE_POINTS).tolist()
+    lats = np.linspace(lat_min, lat_max, BOX_EDGE_POINTS).tolist()
+    ring = (
+        [[lon, lat_min] for lon in lons]
+        + [[lon_max, lat] for lat in lats[1:]]
+        + [[lon, lat_max] for lon in lons[::-1][1:]]
+        + [[lon_min, lat] for lat in lats[::-1][1:]]
+    )
+    return {"position": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+
+def _time_filter(start: Optional[datetime], end: Optional[datetime]) -> dict:
+    dt_range = {}
+    if start is not None:
+        dt_range["$gte"] = start
+    if end is not None:
+        dt_range["$lte"] = end
+    return {"utc_dt": dt_range} if dt_range else {}
+
+
+def _positions_frame(coll: Collection, query: dict, fields: List[str]) -> pd.DataFrame:
+    docs = coll.find(
+        query, {"_id": False, "utc_dt": True, "position": True, **{field: True for field in fields}}
+    ).sort("utc_dt", 1)
+    rows = []
+    for doc in docs:
+        lon, lat = doc.pop('position')['coordinates']
+        rows.append({**doc, 'lat': lat, 'lon': lon})
+    return pd.DataFrame(rows, columns=['utc_dt', 'lat', 'lon', *fields]).set_index('utc_dt')
+
+
+def records_near(
+    coll: Collection,
+    lat: float,
+    lon: float,
+    radius_km: float,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: List[str] = (),
+) -> pd.DataFrame:
+    """Records within 'radius_km' of point (lat, lon), optionally between 'start' and 'end' (inclusive)
+
+    Returns:
+        pd.DataFrame: lat, lon (decimal degrees) and 'fields' columns indexed with utc_dt,
+            NaN where field is absent
+    """
+    return _positions_frame(coll, {**near_filter(lat, lon, radius_km), **_time_filter(start, end)}, list(fields))
+
+
+def records_in_box(
+    coll: Collection,
+    lat_min: float,
+    lat_max: float,
+    lon_min: float,
+    lon_max: float,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: List[str] = (),
+) -> pd.DataFrame:
+    """Records with lat_min <= lat <= lat_max and lon_min <= lon <= lon_max (decimal degrees),
+    optionally between 'start' and 'end' (inclusive), see records_near for return format
+    """
+    df = _positions_frame(
+        coll, {**box_filter(lat_min, lat_max, lon_min, lon_max), **_time_filter(start, end)}, list(fields)
+    )
+    # polygon edges are geodesics, records near them are checked exactly
+    in_box = df['lat'].between(lat_min, lat_max) & df['lon'].between(lon_min, lon_max)
+    return df[in_box]
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    for collection_name in ('from_datum_tables', 'from_ground_logs', 'master'):
+        print(f'computing positions in {collection_name}...')
+        backfill_positions(client.sphere_telemetry[collection_name])
@@ -0,0 +1,113 @@
+"""Queries to HV channel currents store, see telemetry_etl/telemetry_hv_etl.py for its layout
+
+>>> from telemetry_querying.hv_currents import HVCurrentStore
+>>> store = HVCurrentStore('path/to/hv_store')
+>>> I = store.pmt_currents(start_dt, end_dt)  # time x PMT DataFrame
+>>> I[42].plot()
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+def _to_ns(dt: datetime) -> int:
+    return int(np.datetime64(dt, 'ns').astype(np.int64))
+
+
+class HVCurrentStore:
+    """Memory-mapped time x channel currents with per-year HV -> VIP -> PMT mapping"""
+
+    def __init__(self, store_dir: Union[str, Path]):
+        self.store_dir = Path(store_dir)
+        self.utc_dt = np.load(self.store_dir / 'utc_dt.npy', mmap_mode='r')
+        self.currents = np.load(self.store_dir / 'currents.npy', mmap_mode='r')
+        self.channels = np.load(self.store_dir / 'channels.npy')
+        with np.load(self.store_dir / 'mapping.npz') as mapping:
+            self.years = mapping['years']
+            hv = mapping['hv']
+            pmt = mapping['pmt']
+            vip = mapping['vip']
+            self.vip_error = mapping['vip_error']
+
+        # mapping columns rearranged to the order of currents columns, -1 for channels absent in mapping
+        hv_idx = np.searchsorted(hv, self.channels)
+        in_mapping = (hv_idx < len(hv)) & (hv[np.minimum(hv_idx, len(hv) - 1)] == self.channels)
+        hv_idx = np.minimum(hv_idx, len(hv) - 1)
+        self.channel_pmt = np.where(in_mapping, pmt[:, hv_idx], -1)
+        self.channel_vip = np.where(in_mapping, vip[:, hv_idx], -1)
+
+    def _year_idx(self, year: int) -> int:
+        year_idx = np.nonzero(self.years == year)[0]
+        if len(year_idx) == 0:
+            raise ValueError(f"No HV mapping for {year}")
+        return int(year_idx[0])
+
+    def _rows(self, start: datetime, end: datetime) -> slice:
+        return slice(
+            np.searchsorted(self.utc_dt, _to_ns(start), side='left'),
+            np.searchsorted(self.utc_dt, _to_ns(end), side='right'),
+        )
+
+    def channel_currents(self, start: datetime, end: datetime) -> pd.DataFrame:
+        """Currents of all HV channels recorded between 'start' and 'end' (inclusive)
+
+        Returns:
+            pd.DataFrame: time x HV channel, indexed with utc_dt
+        """
+        rows = self._rows(start, end)
+        return pd.DataFrame(
+            data=np.asarray(self.currents[rows]),
+            index=pd.DatetimeIndex(self.utc_dt[rows].astype('datetime64[ns]'), name='utc_dt'),
+            columns=pd.Index(self.channels, name='hv'),
+        )
+
+    def channel_errors(self, year: int) -> np.ndarray:
+        """Mask of currents columns connected to erroneous VIPs in year"""
+        year_idx = self._year_idx(year)
+        vip = self.channel_vip[year_idx]
+        return (vip >= 0) & self.vip_error[year_idx, np.maximum(vip, 0)]
+
+    def pmt_currents(
+        self, start: datetime, end: datetime, pmts: Optional[List[int]] = None, drop_errors: bool = True
+    ) -> pd.DataFrame:
+        """Currents per PMT recorded between 'start' and 'end' (inclusive)
+
+        Args:
+            start, end (datetime): time range, may span several years with different mappings
+            pmts (list of int | None): PMT numbers, all connected ones by default
+            drop_errors (bool): exclude currents through VIPs marked erroneous for the year
+
+        Returns:
+            pd.DataFrame: time x PMT, indexed with utc_dt, NaN where PMT was not connected (or excluded)
+        """
+        rows = self._rows(start, end)
+        utc_dt = self.utc_dt[rows].astype('datetime64[ns]')
+        years = utc_dt.astype('datetime64[Y]').astype(int) + 1970
+        # timestamps are sorted, so each year is a contiguous block of rows
+        year_bounds = np.nonzero(np.diff(years))[0] + 1
+        block_starts = np.r_[0, year_bounds] if len(years) else []
+        parts = []
+        for block_start, block_end in zip(block_starts, np.r_[year_bounds, len(years)]):
+            year = int(years[block_start])
+            year_idx = self._year_idx(year)
+            pmt = self.channel_pmt[year_idx]
+            connected = pmt >= 0
+            if drop_errors:
+                connected &= ~self.channel_errors(year)
+            columns = np.nonzero(connected)[0]
+            block_rows = slice(rows.start + block_start, rows.start + block_end)
+            parts.append(pd.DataFrame(
+                data=np.asarray(self.currents[block_rows])[:, columns],
+                index=pd.DatetimeIndex(utc_dt[block_start:block_end], name='utc_dt'),
+                columns=pd.Index(pmt[columns], name='pmt'),
+            ))
+        if not parts:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name='utc_dt'), columns=pd.Index(pmts or [], name='pmt'))
+        df = pd.concat(parts).sort_index(axis=1)
+        if pmts is not None:
+            df = df.reindex(columns=pd.Index(pmts, name='pmt'))
+        return df
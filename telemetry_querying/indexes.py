@@ -0,0 +1,198 @@
+"""Index provisioning and query plan checks for the telemetry database
+
+Nearly every query combines a utc_dt range with {field: {$exists: true}} on a sparse
+field, and ETL scripts upsert records filtering by utc_dt or local_dt. Without indexes
+all of them are collection scans. Indexes are created with
+
+    python -m telemetry_querying.indexes
+
+which also checks that the standard query shapes use them. ensure_indexes is idempotent
+and is called from ETL scripts, so a freshly restored dump gets indexed on the first run.
+
+master gets a unique utc_dt index and, for each field in INDEXED_FIELDS, a compound
+(utc_dt, field) index partial on the field presence: it holds only records with the
+field, so range reads of sparse fields do not touch records without it. Every such
+index is updated on each upsert of a record with the field, so only the fields read
+by range and neighbour queries are indexed by default; others are added with
+
+    python -m telemetry_querying.indexes --fields Clin1 Clin2
+
+Positions (see telemetry_querying.geo) get a compound 2dsphere index with utc_dt.
+"""
+
+from pymongo import ASCENDING, GEOSPHERE, MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from .field_names import numeric_field_names
+from .flights import flight_index_collection
+from .geo import near_filter
+
+
+# fields read with field_range, interpolate_field and resampling in height_correction,
+# atmospheres and notebooks
+INDEXED_FIELDS = ['H_m', 'P0_hPa', 'P1_hPa', 'T0_C', 'T1_C', 'compass']
+
+# collection name -> index keys used for upserts, see telemetry_etl
+SOURCE_INDEXES = {
+    'from_datum_tables': [[('utc_dt', ASCENDING)]],
+    'from_ground_logs': [[('local_dt', ASCENDING)], [('utc_dt', ASCENDING)]],
+}
+
+# any datetime works for explain, only the query shape matters
+_EXPLAIN_DT = datetime(2013, 3, 13)
+
+
+def field_index_name(field: str) -> str:
+    return f"utc_dt_{field}_partial"
+
+
+def _normalized_keys(keys) -> List[tuple]:
+    # directions read back from dumps may be floats
+    return [(key, int(direction) if isinstance(direction, float) else direction) for key, direction in keys]
+
+
+def ensure_index(
+    coll: Collection,
+    keys: List[tuple],
+    name: Optional[str] = None,
+    unique: bool = False,
+    partialFilterExpression: Optional[dict] = None,
+) -> str:
+    """create_index tolerating existing indexes on the same keys under other names
+
+    An index with the same keys, uniqueness and partial filter is reused whatever its name
+    (e.g. default utc_dt_1 from a restored dump), one with the same keys and other options is
+    dropped and rebuilt. Unique index build failing on duplicate records raises ValueError.
+
+    Returns:
+        str: name of the index
+    """
+    for existing_name, info in coll.index_information().items():
+        if _normalized_keys(info['key']) != _normalized_keys(keys):
+            continue
+        if (
+            info.get('unique', False) == unique
+            and info.get('partialFilterExpression') == partialFilterExpression
+        ):
+            return existing_name
+        coll.drop_index(existing_name)
+
+    options = {'unique': unique} if unique else {}
+    if partialFilterExpression is not None:
+        options['partialFilterExpression'] = partialFilterExpression
+    if name is not None:
+        options['name'] = name
+    try:
+        return coll.create_index(keys, **options)
+    except DuplicateKeyError as e:
+        key_names = ', '.join(key for key, _ in keys)
+        raise ValueError(
+            f"Can't create unique index on ({key_names}) in {coll.full_name}: collection has records "
+            f"with duplicate ({key_names}), remove them and run again ({e})"
+        ) from e
+
+
+def ensure_master_indexes(master: Collection, fields: List[str] = INDEXED_FIELDS):
+    invalid_fields = [field for field in fields if field not in numeric_field_names]
+    if invalid_fields:
+        raise ValueError(f"Invalid fields {invalid_fields}")
+    ensure_index(master, [('utc_dt', ASCENDING)], unique=True, name='utc_dt_unique')
+    for field in fields:
+        ensure_index(
+            master,
+            [('utc_dt', ASCENDING), (field, ASCENDING)],
+            partialFilterExpression={field: {'$exists': True}},
+            name=field_index_name(field),
+        )
+    # records_near, records_in_box; 2dsphere index skips records without position
+    ensure_index(master, [('position', GEOSPHERE), ('utc_dt', ASCENDING)], name='position_utc_dt')
+    ensure_index(
+        flight_index_collection(master),
+        [('year', ASCENDING), ('n_in_year', ASCENDING)],
+        unique=True,
+        name='year_n_in_year_unique',
+    )
+
+
+def ensure_indexes(db: Database, fields: List[str] = INDEXED_FIELDS):
+    """Create all indexes used by telemetry_querying and telemetry_etl, existing ones are reused, see ensure_index
+
+    Partial (utc_dt, field) indexes are created for 'fields' only, pass INDEXED_FIELDS + [...]
+    to index more of them. Rollup and bucket collections are keyed by bucket start in _id and need no extra indexes.
+    """
+    ensure_master_indexes(db.master, fields)
+    for collection_name, indexes in SOURCE_INDEXES.items():
+        for keys in indexes:
+            ensure_index(db[collection_name], keys)
+
+
+def standard_queries(db: Database, fields: List[str] = INDEXED_FIELDS) -> Iterator[Tuple[str, Collection, dict, list]]:
+    """Query shapes used throughout telemetry_querying, telemetry_etl and notebooks
+
+    Yields:
+        description, collection, filter and sort of each query
+    """
+    dt_range = {'$gte': _EXPLAIN_DT, '$lte': _EXPLAIN_DT}
+    for field in fields:
+        # field_range, resample_field
+        yield f"{field} range", db.master, {'utc_dt': dt_range, field: {'$exists': True}}, [('utc_dt', 1)]
+        # interpolate_field neighbour lookup
+        yield (
+            f"{field} neighbour",
+            db.master,
+            {'utc_dt': {'$lte': _EXPLAIN_DT}, field: {'$exists': True}},
+            [('utc_dt', -1)],
+        )
+    yield "master upsert", db.master, {'utc_dt': _EXPLAIN_DT}, []
+    yield "position lookup", db.master, {**near_filter(51.8, 104.4, 5), 'utc_dt': dt_range}, []
+    yield "flight lookup", flight_index_collection(db.master), {'year': 2013, 'n_in_year': 1}, []
+    for collection_name, indexes in SOURCE_INDEXES.items():
+        for keys in indexes:
+            key = keys[0][0]
+            yield f"{collection_name} {key} lookup", db[collection_name], {key: _EXPLAIN_DT}, []
+
+
+def _plan_stages(plan) -> Iterator[str]:
+    """All stage names in explain() output, for any server version's plan layout"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def check_query_plans(db: Database, fields: List[str] = INDEXED_FIELDS):
+    """Run explain() on standard query shapes, raise if any of them is planned as a collection scan"""
+    collscans = []
+    for description, coll, filter_, sort in standard_queries(db, fields):
+        cursor = coll.find(filter_).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        if 'COLLSCAN' in _plan_stages(cursor.explain()['queryPlanner']['winningPlan']):
+            collscans.append(f"{description} ({coll.name}: {filter_})")
+    if collscans:
+        raise ValueError(
+            "Queries fall back to collection scan, see telemetry_querying.indexes.ensure_indexes:\n"
+            + "\n".join(collscans)
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create indexes in telemetry database and check query plans")
+    parser.add_argument("--fields", nargs="+", default=[], help="fields to index in addition to INDEXED_FIELDS")
+    args = parser.parse_args()
+    fields = INDEXED_FIELDS + [field for field in args.fields if field not in INDEXED_FIELDS]
+
+    client = MongoClient()
+    ensure_indexes(client.sphere_telemetry, fields)
+    check_query_plans(client.sphere_telemetry, fields)
+    print("all standard queries use indexes")
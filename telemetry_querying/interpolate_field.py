@@ -1,63 +1,82 @@
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from datetime import datetime
-from typing import Any, List
+from typing import Any, Iterable, List
 
+import numpy as np
+import pandas as pd
 
-def interpolate_field(coll: Collection, field: str, dts: List[datetime], kind: str = 'linear') -> Any:
-    """Get linearly interpolated value of 'field' from database at arbitrary datetime 'dt'
+from .field_range import field_range
+from .buckets import has_buckets, bucket_collection, bucket_neighbour_dt
+
+
+INTERPOLATION_KINDS = ('linear', 'nearest')
+
+
+def neighbour_pipeline(field: str, dt: datetime, direction: int) -> List[dict]:
+    """Aggregation pipeline selecting the closest to 'dt' document with 'field',
+    before it (direction=-1) or after it (direction=1)"""
+    cmp_ = "$lte" if direction == -1 else "$gte"
+    return [
+        {"$match": {"utc_dt": {cmp_: dt}, field: {"$exists": True}}},
+        {"$sort": {"utc_dt": direction}},
+        {"$limit": 1},
+        {"$project": {"_id": False, "utc_dt": True}},
+    ]
+
+
+def neighbour_dt(docs: Iterable[dict], dt: datetime) -> datetime:
+    for doc in docs:
+        return doc['utc_dt']
+    raise IndexError(f"Requested dt={dt} seems to be out of bounds!")
+
+
+def interpolate_series(series: pd.Series, dts: List[datetime], kind: str = 'linear') -> List[Any]:
+    """Interpolate time-indexed Series (as returned by field_range) at 'dts', preserving their order"""
+
+    def as_ns(dts_) -> np.ndarray:
+        return np.asarray(pd.DatetimeIndex(dts_).values, dtype='datetime64[ns]').astype(np.int64)
+
+    t = as_ns(series.index)
+    values = series.to_numpy()
+    t_query = as_ns(dts)
+    if kind == 'linear':
+        return np.interp(t_query, t, values).tolist()
+    elif kind == 'nearest':
+        if len(t) == 1:
+            return [values[0]] * len(t_query)
+        ridx = np.clip(np.searchsorted(t, t_query), 1, len(t) - 1)
+        lidx = ridx - 1
+        left_is_closer = (t_query - t[lidx]) < (t[ridx] - t_query)
+        return np.where(left_is_closer, values[lidx], values[ridx]).tolist()
+    else:
+        raise ValueError(f"Invalid interpolation kind '{kind}'")
+
+
+def interpolate_field(coll: Collection, field: str, dts: List[datetime], kind: str = 'linear') -> List[Any]:
+    """Get interpolated values of 'field' from database at arbitrary datetimes 'dts'
 
     Supported interpolation types: linear, nearest
     """
+    if kind not in INTERPOLATION_KINDS:
+        raise ValueError(f"Invalid interpolation kind '{kind}'")
 
-    def next_to_dt(field: str, dt: datetime, direction: int) -> Any:
-        cmp_ = "$lte" if direction == -1 else "$gte"
-        try:
-            doc = coll.aggregate([
-                {"$match": {"utc_dt": {cmp_: dt}, field: {"$exists": True}}},
-                {"$sort": {"utc_dt": direction}}
-            ]).next()
-            # print(doc['_id'])  # for debugging
-            return doc['utc_dt'], doc[field]
-        except StopIteration:
-            raise IndexError(f"Requested dt={dt} seems to be out of bounds!")
-
-    def interp(dt, ldt, rdt, lval, rval, kind):
-        ldelta = (dt - ldt).total_seconds()
-        rdelta = (rdt - dt).total_seconds()
-        if kind == 'linear':
-            return lval + (rval - lval) * ldelta / (ldelta + rdelta)
-        elif kind == 'nearest':
-            return lval if ldelta < rdelta else rval
-        else:
-            raise ValueError(f"Invalid interpolation kind '{kind}'")
-
-    if coll.find_one(filter={field: {"$exists": True}}) is None:
+    bucketed = has_buckets(coll)
+    # bucket documents are much fewer, so the field check is cheaper there
+    source = bucket_collection(coll) if bucketed else coll
+    if source.find_one(filter={field: {"$exists": True}}, projection={'_id': True}) is None:
         raise ValueError(f"Invalid field '{field}'")
 
-    dts = sorted(dts)  # , key=lambda dt: dt.total_seconds)
-    interp_field = []
-
-    startdt, lval = next_to_dt(field, dts[0], -1)
-    enddt, _ = next_to_dt(field, dt[-1], 1)
-
-    interp_idx = 0
-    ldt = startdt
-    for doc in coll.aggregate([
-        {"$match": {"utc_dt": {"$gte": startdt, "$lte": enddt}, field: {"$exists": True}}},
-        {"$sort": {"utc_dt": 1}},
-        {"$project": {"utc_dt": True, field: True}}
-    ]):
-        if doc['utc_dt'] <= dts[interp_idx]:
-            ldt = doc['utc_dt']
-            lval = doc[field]
-        else:
-            rdt = doc['utc_dt']
-            rval = doc[field]
-            while interp_idx < len(dts) and dts[interp_idx] <= rdt:
-                interp_field.append(interp(dts[interp_idx], ldt, rdt, lval, rval, kind))
-                interp_idx += 1
-    return interp_field
+    first_dt = min(dts)
+    last_dt = max(dts)
+    if bucketed:
+        startdt = bucket_neighbour_dt(source, field, first_dt, -1)
+        enddt = bucket_neighbour_dt(source, field, last_dt, 1)
+    else:
+        startdt = neighbour_dt(coll.aggregate(neighbour_pipeline(field, first_dt, -1)), first_dt)
+        enddt = neighbour_dt(coll.aggregate(neighbour_pipeline(field, last_dt, 1)), last_dt)
+
+    return interpolate_series(field_range(coll, field, startdt, enddt), dts, kind)
 
 
 if __name__ == "__main__":
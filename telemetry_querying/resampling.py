@@ -0,0 +1,115 @@
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime, timedelta
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+
+RESAMPLING_MODES = ('stats', 'envelope')
+
+
+def step_to_ms(step: Union[float, timedelta]) -> int:
+    """Grid step given as timedelta or number of seconds -> integer milliseconds"""
+    if isinstance(step, timedelta):
+        step_ms = int(round(step.total_seconds() * 1000))
+    else:
+        step_ms = int(round(step * 1000))
+    if step_ms <= 0:
+        raise ValueError(f"Grid step must be positive, got {step}")
+    return step_ms
+
+
+def resample_pipeline(
+    field: str, start: datetime, end: datetime, step: Union[float, timedelta], mode: str = 'stats'
+) -> List[dict]:
+    """Aggregation pipeline bucketing 'field' values on uniform grid start, start + step, ... < end
+
+    Each output document has bucket number (counted from start) as _id and
+    count, mean, min and max of the field values in the bucket. In 'envelope'
+    mode min and max are subdocuments {v: value, t: utc_dt}, so that extrema
+    can be plotted at their actual times.
+    """
+    if mode not in RESAMPLING_MODES:
+        raise ValueError(f"Invalid resampling mode '{mode}'")
+    value = f"${field}"
+    extremum = {"v": value, "t": "$utc_dt"} if mode == 'envelope' else value
+    return [
+        {"$match": {"utc_dt": {"$gte": start, "$lt": end}, field: {"$exists": True}}},
+        {"$group": {
+            # date - date = milliseconds
+            "_id": {"$floor": {"$divide": [{"$subtract": ["$utc_dt", start]}, step_to_ms(step)]}},
+            "count": {"$sum": 1},
+            "mean": {"$avg": value},
+            "min": {"$min": extremum},
+            "max": {"$max": extremum},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def resample_field(
+    coll: Collection,
+    field: str,
+    start: datetime,
+    end: datetime,
+    step: Union[float, timedelta],
+    full_grid: bool = True,
+) -> pd.DataFrame:
+    """Get 'field' on uniform time grid with server-side bucketing
+
+    Args:
+        coll (Collection): telemetry collection, normally master
+        field (str): field name
+        start, end (datetime): time range, end is not included
+        step (float | timedelta): grid step, in seconds if number
+        full_grid (bool): if True, empty buckets are included with count = 0 and NaN stats
+
+    Returns:
+        pd.DataFrame: count, mean, min and max columns indexed with bucket start time (utc_dt)
+    """
+    docs = list(coll.aggregate(resample_pipeline(field, start, end, step), allowDiskUse=True))
+    step_ms = step_to_ms(step)
+    df = pd.DataFrame(
+        data={key: [doc[key] for doc in docs] for key in ('count', 'mean', 'min', 'max')},
+        index=pd.Index([int(doc['_id']) for doc in docs], dtype=np.int64),
+    )
+    df = df.astype({'count': np.int64, 'mean': float, 'min': float, 'max': float})
+    if full_grid:
+        n_buckets = int(np.ceil((end - start).total_seconds() * 1000 / step_ms))
+        df = df.reindex(pd.RangeIndex(n_buckets))
+        df['count'] = df['count'].fillna(0).astype(np.int64)
+    df.index = pd.DatetimeIndex(
+        pd.Timestamp(start) + pd.to_timedelta(df.index.to_numpy() * step_ms, unit='ms'), name='utc_dt'
+    )
+    return df
+
+
+def resample_field_envelope(
+    coll: Collection, field: str, start: datetime, end: datetime, step: Union[float, timedelta],
+) -> pd.Series:
+    """Min/max envelope of 'field' for plotting: for each grid bucket its minimum
+    and maximum values at the times they were recorded, in chronological order.
+    Plotting the result gives the same picture as plotting all raw values, while
+    only 2 points per bucket are transferred
+    """
+    dts = []
+    values = []
+    for doc in coll.aggregate(resample_pipeline(field, start, end, step, mode='envelope'), allowDiskUse=True):
+        extrema = sorted([doc['min'], doc['max']], key=lambda extremum: extremum['t'])
+        if extrema[0]['t'] == extrema[1]['t']:  # single value in bucket
+            extrema = extrema[:1]
+        for extremum in extrema:
+            dts.append(extremum['t'])
+            values.append(extremum['v'])
+    return pd.Series(data=values, index=pd.DatetimeIndex(dts, name='utc_dt'), name=field, dtype=float)
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    test = client.sphere_telemetry.master
+    start = datetime.strptime("2013-03-13 08:00:00", r"%Y-%m-%d %X")
+    end = datetime.strptime("2013-03-13 12:00:00", r"%Y-%m-%d %X")
+    print(resample_field(test, 'H_m', start, end, step=60))
+    print(resample_field_envelope(test, 'H_m', start, end, step=60))
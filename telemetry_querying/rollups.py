@@ -0,0 +1,186 @@
+"""Precomputed multi-resolution rollups of the master collection
+
+Rollup collections (master_rollup_1min, master_rollup_10min, master_rollup_1h)
+hold one document per time bucket with count, mean, min and max of every numeric
+field recorded in it:
+
+    {
+        "_id" : ISODate("2013-03-13T08:00:00.000Z"),  // bucket start, epoch-aligned
+        "utc_dt" : ISODate("2013-03-13T08:00:00.000Z"),
+        "H_m" : {"count" : 17, "mean" : 450.1, "min" : 449.0, "max" : 451.0},
+        ...
+    }
+
+The finest rollup is aggregated from master, each coarser one — from the previous
+rollup, so that building all resolutions costs about one pass over master. Rollups
+are built by running this module:
+
+    python -m telemetry_querying.rollups
+
+and are updated for the time range of newly merged data with update_rollups.
+"""
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from datetime import datetime, timedelta
+from typing import List
+
+import pandas as pd
+
+from tqdm import tqdm
+
+from .field_names import numeric_field_names
+from .resampling import resample_field
+
+
+# label -> bucket size in sec, from finest to coarsest; each size must divide the next one
+ROLLUP_RESOLUTIONS = {
+    '1min': 60,
+    '10min': 600,
+    '1h': 3600,
+}
+
+# rollups are (re)computed chunk by chunk to bound aggregation memory on the server
+ROLLUP_CHUNK = timedelta(days=7)
+
+
+def rollup_collection(master: Collection, label: str) -> Collection:
+    return master.database[f"{master.name}_rollup_{label}"]
+
+
+def floor_dt(dt: datetime, step_sec: int) -> datetime:
+    return pd.Timestamp(dt).floor(pd.Timedelta(seconds=step_sec)).to_pydatetime()
+
+
+def ceil_dt(dt: datetime, step_sec: int) -> datetime:
+    return pd.Timestamp(dt).ceil(pd.Timedelta(seconds=step_sec)).to_pydatetime()
+
+
+def _bucket_start(step_sec: int) -> dict:
+    utc_ms = {"$toLong": "$utc_dt"}
+    return {"$toDate": {"$subtract": [utc_ms, {"$mod": [utc_ms, step_sec * 1000]}]}}
+
+
+def _stats_projection(fields: List[str], mean_expr) -> dict:
+    """Pack flat per-field accumulators to {count, mean, min, max} subdocuments, skipping absent fields"""
+    projection = {"utc_dt": "$_id"}
+    for field in fields:
+        projection[field] = {"$cond": [
+            {"$gt": [f"${field}__count", 0]},
+            {
+                "count": f"${field}__count",
+                "mean": mean_expr(field),
+                "min": f"${field}__min",
+                "max": f"${field}__max",
+            },
+            "$$REMOVE",
+        ]}
+    return projection
+
+
+def rollup_from_master_pipeline(
+    target: Collection, start: datetime, end: datetime, step_sec: int, fields: List[str] = numeric_field_names
+) -> List[dict]:
+    group = {"_id": _bucket_start(step_sec)}
+    for field in fields:
+        group[f"{field}__count"] = {"$sum": {"$cond": [{"$gt": [f"${field}", None]}, 1, 0]}}
+        group[f"{field}__mean"] = {"$avg": f"${field}"}
+        group[f"{field}__min"] = {"$min": f"${field}"}
+        group[f"{field}__max"] = {"$max": f"${field}"}
+    return [
+        {"$match": {"utc_dt": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+        {"$project": _stats_projection(fields, lambda field: f"${field}__mean")},
+        {"$merge": {"into": target.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def rollup_from_rollup_pipeline(
+    target: Collection, start: datetime, end: datetime, step_sec: int, fields: List[str] = numeric_field_names
+) -> List[dict]:
+    group = {"_id": _bucket_start(step_sec)}
+    for field in fields:
+        group[f"{field}__count"] = {"$sum": f"${field}.count"}
+        group[f"{field}__sum"] = {"$sum": {"$multiply": [f"${field}.mean", f"${field}.count"]}}
+        group[f"{field}__min"] = {"$min": f"${field}.min"}
+        group[f"{field}__max"] = {"$max": f"${field}.max"}
+    return [
+        {"$match": {"_id": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+        {"$project": _stats_projection(
+            fields, lambda field: {"$divide": [f"${field}__sum", f"${field}__count"]}
+        )},
+        {"$merge": {"into": target.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def update_rollups(master: Collection, start: datetime, end: datetime, progress: bool = False):
+    """Recompute all rollup buckets overlapping [start, end], e.g. after new data is merged to master"""
+    coarsest_step = max(ROLLUP_RESOLUTIONS.values())
+    start = floor_dt(start, coarsest_step)
+    end = ceil_dt(end + timedelta(microseconds=1), coarsest_step)
+
+    chunk_starts = []
+    while start + len(chunk_starts) * ROLLUP_CHUNK < end:
+        chunk_starts.append(start + len(chunk_starts) * ROLLUP_CHUNK)
+    for chunk_start in tqdm(chunk_starts, disable=not progress):
+        chunk_end = min(chunk_start + ROLLUP_CHUNK, end)
+        source = None
+        for label, step_sec in ROLLUP_RESOLUTIONS.items():
+            target = rollup_collection(master, label)
+            if source is None:
+                pipeline = rollup_from_master_pipeline(target, chunk_start, chunk_end, step_sec)
+                master.aggregate(pipeline, allowDiskUse=True)
+            else:
+                pipeline = rollup_from_rollup_pipeline(target, chunk_start, chunk_end, step_sec)
+                source.aggregate(pipeline, allowDiskUse=True)
+            source = target
+
+
+def build_rollups(master: Collection, progress: bool = True):
+    """Compute rollups over the whole master collection"""
+    first_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", 1)])
+    last_doc = master.find_one({"utc_dt": {"$exists": True}}, sort=[("utc_dt", -1)])
+    if first_doc is None:
+        return
+    update_rollups(master, first_doc['utc_dt'], last_doc['utc_dt'], progress=progress)
+
+
+def rollup_field_range(rollup: Collection, field: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """Read 'field' stats from rollup collection for buckets starting in [start, end)
+
+    Returns:
+        pd.DataFrame: same as resample_field(..., full_grid=False)
+    """
+    data = {key: [] for key in ('count', 'mean', 'min', 'max')}
+    dts = []
+    for doc in rollup.find({"_id": {"$gte": start, "$lt": end}, field: {"$exists": True}}, {field: True}).sort("_id", 1):
+        dts.append(doc['_id'])
+        for key, values in data.items():
+            values.append(doc[field][key])
+    df = pd.DataFrame(data=data, index=pd.DatetimeIndex(dts, name='utc_dt'))
+    return df.astype({'count': 'int64', 'mean': float, 'min': float, 'max': float})
+
+
+def field_overview(master: Collection, field: str, start: datetime, end: datetime, n_points: int = 1000) -> pd.DataFrame:
+    """Get 'field' stats over [start, end) at the coarsest resolution that gives
+    at least 'n_points' buckets. Precomputed rollups are used where possible,
+    otherwise master is bucketed on the fly with resample_field.
+
+    Returns:
+        pd.DataFrame: count, mean, min and max columns indexed with bucket start time (utc_dt),
+        empty buckets are not included
+    """
+    span_sec = (end - start).total_seconds()
+    existing_collections = set(master.database.list_collection_names())
+    for label, step_sec in sorted(ROLLUP_RESOLUTIONS.items(), key=lambda item: item[1], reverse=True):
+        rollup = rollup_collection(master, label)
+        if span_sec / step_sec >= n_points and rollup.name in existing_collections:
+            return rollup_field_range(rollup, field, floor_dt(start, step_sec), end)
+    # master is recorded with ~1 sec period, finer buckets make no sense
+    return resample_field(master, field, start, end, step=max(span_sec / n_points, 1), full_grid=False)
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    build_rollups(client.sphere_telemetry.master)